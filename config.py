@@ -1,6 +1,13 @@
 
 import os
+import copy
+import json
+import queue
+import atexit
+import random
 import logging
+import logging.handlers
+import contextvars
 from datetime import datetime
 
 class Config:
@@ -10,20 +17,113 @@ class Config:
     PRINTFUL_API_KEY = os.getenv("PRINTFUL_API_KEY")
     SUPABASE_URL = os.getenv("SUPABASE_URL", "https://jxylbuwtjvsdavetryjx.supabase.co")
     SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+    SUPABASE_TIMEOUT_SECONDS = float(os.getenv("SUPABASE_TIMEOUT_SECONDS", 10))
+    SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", 20))
+    SUPABASE_MAX_RETRIES = int(os.getenv("SUPABASE_MAX_RETRIES", 2))
     
     # App Configuration
     DEBUG = os.getenv("DEBUG", "False").lower() == "true"
+    APP_ENV = os.getenv("APP_ENV", "production").lower()
     PORT = int(os.getenv("PORT", 5000))
     HOST = "0.0.0.0"
     
+    # LLM request budget (per request, shared across all providers/models)
+    LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", 20))
+    LLM_MAX_DEADLINE_SECONDS = float(os.getenv("LLM_MAX_DEADLINE_SECONDS", 45))
+    LLM_MIN_ATTEMPT_SECONDS = float(os.getenv("LLM_MIN_ATTEMPT_SECONDS", 2))
+    
+    # Fault/latency injection on outbound calls (ignored when APP_ENV is production)
+    FAULT_INJECTION = os.getenv("FAULT_INJECTION", "")
+    
+    # Per-attempt LLM telemetry (raw rows kept for retention, hourly rollups kept indefinitely)
+    LLM_TELEMETRY_FLUSH_SECONDS = int(os.getenv("LLM_TELEMETRY_FLUSH_SECONDS", 10))
+    LLM_TELEMETRY_RETENTION_DAYS = int(os.getenv("LLM_TELEMETRY_RETENTION_DAYS", 7))
+    
+    # Model routing by prompt complexity (MODEL_ROUTES: JSON overrides, see services/model_router.py)
+    MODEL_ROUTES = os.getenv("MODEL_ROUTES", "")
+    ROUTER_FAST_MAX_WORDS = int(os.getenv("ROUTER_FAST_MAX_WORDS", 12))
+    ROUTER_COMPLEX_MIN_WORDS = int(os.getenv("ROUTER_COMPLEX_MIN_WORDS", 80))
+    
+    # Opt-in traffic capture for offline replay (empty = disabled)
+    TRAFFIC_CAPTURE_PATH = os.getenv("TRAFFIC_CAPTURE_PATH", "")
+    TRAFFIC_CAPTURE_SAMPLE_RATE = float(os.getenv("TRAFFIC_CAPTURE_SAMPLE_RATE", 1.0))
+    TRAFFIC_CAPTURE_MAX_QUEUE = int(os.getenv("TRAFFIC_CAPTURE_MAX_QUEUE", 10000))
+    
+    # Reuse of open Stripe Checkout Sessions for duplicate checkout requests
+    CHECKOUT_SESSION_TTL_SECONDS = int(os.getenv("CHECKOUT_SESSION_TTL_SECONDS", 600))
+    
+    # Stripe -> Supabase membership reconciliation (0 = only on demand via admin route)
+    RECONCILE_INTERVAL_SECONDS = int(os.getenv("RECONCILE_INTERVAL_SECONDS", 0))
+    
+    # On-demand sampling profiler (X-Profile header must match PROFILE_SECRET)
+    PROFILE_SECRET = os.getenv("PROFILE_SECRET", "")
+    PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+    PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+    
+    # Response compression
+    COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", 1024))
+    
+    # Background dependency probes
+    HEALTH_PROBE_INTERVAL_SECONDS = int(os.getenv("HEALTH_PROBE_INTERVAL_SECONDS", 30))
+    HEALTH_PROBE_TIMEOUT_SECONDS = float(os.getenv("HEALTH_PROBE_TIMEOUT_SECONDS", 5))
+    
+    # Analytics rollups
+    ANALYTICS_INTERVAL_SECONDS = int(os.getenv("ANALYTICS_INTERVAL_SECONDS", 300))
+    STATS_CACHE_SECONDS = int(os.getenv("STATS_CACHE_SECONDS", 60))
+    
+    # Batch chat generation
+    BATCH_MAX_PROMPTS = int(os.getenv("BATCH_MAX_PROMPTS", 500))
+    BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 4))
+    BATCH_REQUESTS_PER_MINUTE = int(os.getenv("BATCH_REQUESTS_PER_MINUTE", 120))
+    
+    # Per-user LLM token quotas (0 = unlimited)
+    LLM_DAILY_TOKEN_QUOTA = int(os.getenv("LLM_DAILY_TOKEN_QUOTA", 200000))
+    LLM_MINUTE_TOKEN_QUOTA = int(os.getenv("LLM_MINUTE_TOKEN_QUOTA", 20000))
+    
+    # Admission control: LLM traffic is capped; payment routes get their own pool
+    ADMISSION_LLM_MAX_INFLIGHT = int(os.getenv("ADMISSION_LLM_MAX_INFLIGHT", 8))
+    ADMISSION_LLM_MAX_QUEUE = int(os.getenv("ADMISSION_LLM_MAX_QUEUE", 16))
+    ADMISSION_MEMBER_RESERVE = int(os.getenv("ADMISSION_MEMBER_RESERVE", 2))
+    ADMISSION_MEMBER_WAIT_SECONDS = float(os.getenv("ADMISSION_MEMBER_WAIT_SECONDS", 3))
+    ADMISSION_ANON_WAIT_SECONDS = float(os.getenv("ADMISSION_ANON_WAIT_SECONDS", 1))
+    ADMISSION_PAYMENTS_MAX_INFLIGHT = int(os.getenv("ADMISSION_PAYMENTS_MAX_INFLIGHT", 16))
+    ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", 5))
+    
     # Business Configuration
     MEMBERSHIP_PRICE = 225
     STRIPE_PAYMENT_LINK = "https://buy.stripe.com/4gw8wVcGh0qkc4o7ss"
     
+    # Logging
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    LOG_FILE = os.getenv("LOG_FILE", "willpower_fitness.log")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()  # "text" or "json"
+    LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "")  # e.g. "midnight"; empty = size-based
+    LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))
+    LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5))
+    # Comma-separated logger=rate pairs, e.g. "services.supabase_repository=0.1"
+    LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+    
     # File paths
     DATABASE_PATH = "willpower_fitness.db"
+    ARCHIVE_DATABASE_PATH = os.getenv("ARCHIVE_DATABASE_PATH", "willpower_fitness_archive.db")
     UPLOAD_FOLDER = "attached_assets/uploads"
     
+    # Sharded storage for users/messages (0 or 1 = single file)
+    SHARD_COUNT = int(os.getenv("SHARD_COUNT", 0))
+    SHARD_POOL_SIZE = int(os.getenv("SHARD_POOL_SIZE", 4))
+    
+    # In-memory per-user context cache (profile + recent messages)
+    CONTEXT_CACHE_USERS = int(os.getenv("CONTEXT_CACHE_USERS", 1000))
+    CONTEXT_CACHE_HISTORY = int(os.getenv("CONTEXT_CACHE_HISTORY", 50))
+    
+    # Message retention (hot/cold partitioning)
+    MESSAGE_RETENTION_DAYS = int(os.getenv("MESSAGE_RETENTION_DAYS", 30))
+    COMPACTION_INTERVAL_SECONDS = int(os.getenv("COMPACTION_INTERVAL_SECONDS", 6 * 3600))
+    ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 5000))
+    ARCHIVE_BLOCK_MESSAGES = int(os.getenv("ARCHIVE_BLOCK_MESSAGES", 500))
+    # Full VACUUM locks each file exclusively; enable once to move existing files to incremental mode
+    COMPACTION_FULL_VACUUM = os.getenv("COMPACTION_FULL_VACUUM", "false").lower() == "true"
+    
     @classmethod
     def validate_required_keys(cls):
         """Validate that required environment variables are set"""
@@ -35,16 +135,120 @@ class Config:
         
         return True
 
+# Set per request (see main.assign_request_id) and stamped onto every record
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of INFO/DEBUG records from noisy loggers; warnings always pass"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        name = record.name
+        while name:
+            if name in self.rates:
+                return random.random() < self.rates[name]
+            name = name.rpartition('.')[0]
+        return True
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'msg': record.getMessage(),
+        }
+        # Records from StructuredQueueHandler arrive with the traceback already in exc_text
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler.prepare() folds the traceback into msg and drops exc_info, which
+    leaves JsonFormatter nothing to put in 'exc'. This keeps the message and the
+    pre-rendered traceback (exc_text) apart so either formatter can use them.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = _traceback_formatter.formatException(record.exc_info)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+_traceback_formatter = logging.Formatter()
+
+def _parse_sample_rates(spec):
+    rates = {}
+    for pair in filter(None, (p.strip() for p in spec.split(','))):
+        name, _, rate = pair.partition('=')
+        try:
+            rates[name.strip()] = max(0.0, min(1.0, float(rate)))
+        except ValueError:
+            pass
+    return rates
+
+_listener = None
+
 def setup_logging():
-    """Configure application logging"""
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.StreamHandler(),
-            logging.FileHandler('willpower_fitness.log')
-        ]
-    )
+    """
+    Configure application logging. Request threads only enqueue records; a
+    background listener thread does the formatting and file/stream I/O.
+    """
+    global _listener
+    if _listener:
+        return
+
+    if Config.LOG_FORMAT == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
+        )
+
+    if Config.LOG_ROTATE_WHEN:
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            Config.LOG_FILE, when=Config.LOG_ROTATE_WHEN, backupCount=Config.LOG_BACKUP_COUNT
+        )
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            Config.LOG_FILE, maxBytes=Config.LOG_MAX_BYTES, backupCount=Config.LOG_BACKUP_COUNT
+        )
+    handlers = [logging.StreamHandler(), file_handler]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = StructuredQueueHandler(log_queue)
+    # Filters run on the calling thread so request ids are captured before enqueueing
+    queue_handler.addFilter(RequestIdFilter())
+    queue_handler.addFilter(SamplingFilter(_parse_sample_rates(Config.LOG_SAMPLE_RATES)))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(Config.LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
     
     # Reduce noise from external libraries
     logging.getLogger('requests').setLevel(logging.WARNING)
@@ -1,16 +1,193 @@
 
+import os
+import queue
 import sqlite3
 import json
-from datetime import datetime
-from contextlib import contextmanager
+import zlib
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from contextlib import contextmanager, nullcontext
 import logging
 
 logger = logging.getLogger(__name__)
 
+_MISSING = object()
+
+# Per-user tables; in sharded mode these live in the shard files, everything else in db_path
+USER_TABLES = ('users', 'messages')
+
+USERS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT UNIQUE NOT NULL,
+        name TEXT NOT NULL,
+        email TEXT,
+        goal TEXT,
+        source TEXT DEFAULT 'website',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+MESSAGES_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    )
+'''
+
+MESSAGES_INDEX = '''
+    CREATE INDEX IF NOT EXISTS idx_messages_user_ts
+    ON messages (user_id, timestamp)
+'''
+
+# Only takes effect on a new, empty file; existing files switch over on a full compact()
+AUTO_VACUUM_PRAGMA = 'PRAGMA auto_vacuum=INCREMENTAL'
+
+def shard_path(db_path, index, count):
+    root, ext = os.path.splitext(db_path)
+    return f"{root}.shard-{index}-of-{count}{ext or '.db'}"
+
+def shard_index(user_id, count):
+    """Stable user -> shard mapping (crc32 is identical across processes and restarts)"""
+    return zlib.crc32(str(user_id).encode('utf-8')) % count
+
+class Shard:
+    """One SQLite shard file with its own small connection pool and a single in-process writer"""
+
+    def __init__(self, index, path, pool_size=4):
+        self.index = index
+        self.path = path
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._write_lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    @contextmanager
+    def writer(self):
+        # Serialise writers in-process instead of letting them spin on SQLITE_BUSY
+        with self._write_lock, self.connection() as conn:
+            yield conn
+
+    def init_schema(self):
+        with self.writer() as conn:
+            conn.execute(AUTO_VACUUM_PRAGMA)
+            conn.execute(USERS_SCHEMA)
+            conn.execute(MESSAGES_SCHEMA)
+            conn.execute(MESSAGES_INDEX)
+            conn.commit()
+
+class UserContextCache:
+    """Bounded LRU of user profiles plus a ring buffer of each user's recent messages"""
+
+    def __init__(self, max_users=1000, history_size=50, lock_stripes=64):
+        self.max_users = max_users
+        self.history_size = history_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._user_locks = [threading.Lock() for _ in range(lock_stripes)]
+        self.hits = 0
+        self.misses = 0
+    
+    def user_lock(self, user_id):
+        """
+        Per-user (striped) lock held across a database read and the cache fill that
+        follows it, and across a write and its cache update, so a fill can never
+        overwrite the cache with rows read before a concurrent write landed.
+        """
+        return self._user_locks[zlib.crc32(str(user_id).encode('utf-8')) % len(self._user_locks)]
+
+    def _entry(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            entry = {'user': _MISSING, 'messages': None, 'complete': False}
+            self._entries[user_id] = entry
+            if len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(user_id)
+        return entry
+
+    def get_user(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry['user'] is _MISSING:
+                self.misses += 1
+                return _MISSING
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return dict(entry['user']) if entry['user'] else None
+
+    def set_user(self, user_id, user):
+        with self._lock:
+            self._entry(user_id)['user'] = dict(user) if user else None
+
+    def get_messages(self, user_id, limit):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            msgs = entry['messages'] if entry else None
+            # Serve from the buffer only if it holds enough rows or the whole history
+            if msgs is None or (len(msgs) < limit and not entry['complete']):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return [dict(m) for m in list(msgs)[-limit:]] if limit else []
+
+    def set_messages(self, user_id, messages, complete):
+        with self._lock:
+            entry = self._entry(user_id)
+            entry['messages'] = deque((dict(m) for m in messages), maxlen=self.history_size)
+            entry['complete'] = complete and len(messages) <= self.history_size
+
+    def append_message(self, user_id, message):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry['messages'] is None:
+                return
+            if len(entry['messages']) == self.history_size:
+                entry['complete'] = False
+            entry['messages'].append(message)
+
+    def stats(self):
+        with self._lock:
+            return {'users': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
 class Database:
-    def __init__(self, db_path="willpower_fitness.db"):
+    def __init__(self, db_path="willpower_fitness.db", archive_path=None, context_cache=None,
+                 shard_count=0, shard_pool_size=4):
         self.db_path = db_path
+        self.archive_path = archive_path
+        self.context_cache = context_cache
+        self.shards = [
+            Shard(i, shard_path(db_path, i, shard_count), shard_pool_size)
+            for i in range(shard_count)
+        ] if shard_count > 1 else []
         self.init_database()
+        for shard in self.shards:
+            shard.init_schema()
+        if self.archive_path:
+            self.init_archive()
     
     @contextmanager
     def get_connection(self):
@@ -24,31 +201,13 @@ class Database:
     def init_database(self):
         """Initialize database with proper schema"""
         with self.get_connection() as conn:
+            conn.execute(AUTO_VACUUM_PRAGMA)
+            
             # Users table
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT UNIQUE NOT NULL,
-                    name TEXT NOT NULL,
-                    email TEXT,
-                    goal TEXT,
-                    source TEXT DEFAULT 'website',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+            conn.execute(USERS_SCHEMA)
             
             # Messages table for conversation history
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT NOT NULL,
-                    role TEXT NOT NULL,
-                    content TEXT NOT NULL,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            ''')
+            conn.execute(MESSAGES_SCHEMA)
             
             # Customers table for paying members
             conn.execute('''
@@ -111,12 +270,174 @@ class Database:
                 )
             ''')
             
+            conn.execute(MESSAGES_INDEX)
+            
+            # Incremental analytics rollups (see services/analytics_service.py)
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS stats_hourly (
+                    metric TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    hour INTEGER NOT NULL,
+                    dimension TEXT NOT NULL DEFAULT '',
+                    count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (metric, day, hour, dimension)
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS stats_gauges (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS rollup_watermarks (
+                    source TEXT PRIMARY KEY,
+                    last_id INTEGER NOT NULL
+                )
+            ''')
+            
+            # Timestamp watermarks for external sync jobs (e.g. Stripe reconciliation)
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS sync_watermarks (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Append-only LLM usage ledger plus per-day rollups used for quotas
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS llm_usage (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_key TEXT NOT NULL,
+                    provider TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    prompt_tokens INTEGER NOT NULL,
+                    completion_tokens INTEGER NOT NULL,
+                    estimated INTEGER DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS llm_usage_daily (
+                    user_key TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    provider TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    requests INTEGER DEFAULT 0,
+                    prompt_tokens INTEGER DEFAULT 0,
+                    completion_tokens INTEGER DEFAULT 0,
+                    PRIMARY KEY (user_key, day, provider, model)
+                )
+            ''')
+            
+            # Per-attempt LLM telemetry (pruned after retention) and its hourly rollup.
+            # Histograms are JSON lists of counts per latency bucket (see services/llm_telemetry.py).
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS llm_calls (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created_at TIMESTAMP NOT NULL,
+                    provider TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    route TEXT,
+                    status TEXT NOT NULL,
+                    fallback INTEGER DEFAULT 0,
+                    queue_ms REAL DEFAULT 0,
+                    ttfb_ms REAL,
+                    total_ms REAL NOT NULL,
+                    prompt_tokens INTEGER DEFAULT 0,
+                    completion_tokens INTEGER DEFAULT 0,
+                    cached_tokens INTEGER DEFAULT 0
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_calls_created ON llm_calls(created_at)')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS llm_calls_hourly (
+                    hour TEXT NOT NULL,
+                    provider TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    route TEXT NOT NULL,
+                    calls INTEGER DEFAULT 0,
+                    errors INTEGER DEFAULT 0,
+                    timeouts INTEGER DEFAULT 0,
+                    fallbacks INTEGER DEFAULT 0,
+                    queue_ms REAL DEFAULT 0,
+                    prompt_tokens INTEGER DEFAULT 0,
+                    completion_tokens INTEGER DEFAULT 0,
+                    cached_tokens INTEGER DEFAULT 0,
+                    latency_hist TEXT,
+                    ttfb_hist TEXT,
+                    PRIMARY KEY (hour, provider, model, route)
+                )
+            ''')
+            
             conn.commit()
             logger.info("Database initialized successfully")
     
+    @contextmanager
+    def get_archive_connection(self):
+        conn = sqlite3.connect(self.archive_path)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+    
+    def _cache_lock(self, user_id):
+        return self.context_cache.user_lock(user_id) if self.context_cache else nullcontext()
+    
+    def _user_reader(self, user_id):
+        if self.shards:
+            return self.shards[shard_index(user_id, len(self.shards))].connection()
+        return self.get_connection()
+    
+    def _user_writer(self, user_id):
+        if self.shards:
+            return self.shards[shard_index(user_id, len(self.shards))].writer()
+        return self.get_connection()
+    
+    def _user_stores(self):
+        """(shard index, writer factory) for every file holding per-user tables"""
+        if self.shards:
+            return [(shard.index, shard.writer) for shard in self.shards]
+        return [(None, self.get_connection)]
+    
+    def init_archive(self):
+        """Initialize cold storage for archived conversation history"""
+        with self.get_archive_connection() as conn:
+            # One row per user per compaction run; payload is zlib-compressed JSON
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS message_archive (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    first_timestamp TIMESTAMP NOT NULL,
+                    last_timestamp TIMESTAMP NOT NULL,
+                    message_count INTEGER NOT NULL,
+                    payload BLOB NOT NULL,
+                    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_archive_user_ts
+                ON message_archive (user_id, last_timestamp)
+            ''')
+            conn.commit()
+    
     def get_user(self, user_id):
         """Get user by user_id"""
-        with self.get_connection() as conn:
+        if not self.context_cache:
+            return self._read_user(user_id)
+        cached = self.context_cache.get_user(user_id)
+        if cached is not _MISSING:
+            return cached
+        with self.context_cache.user_lock(user_id):
+            user = self._read_user(user_id)
+            self.context_cache.set_user(user_id, user)
+        return user
+    
+    def _read_user(self, user_id):
+        with self._user_reader(user_id) as conn:
             result = conn.execute(
                 'SELECT * FROM users WHERE user_id = ?', (user_id,)
             ).fetchone()
@@ -124,40 +445,460 @@ class Database:
     
     def create_user(self, user_id, name, goal, email=None, source='website'):
         """Create new user"""
-        with self.get_connection() as conn:
+        with self._cache_lock(user_id), self._user_writer(user_id) as conn:
             conn.execute('''
                 INSERT OR REPLACE INTO users (user_id, name, email, goal, source, updated_at)
                 VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
             ''', (user_id, name, email, goal, source))
             conn.commit()
             logger.info(f"User created: {user_id} - {name}")
+            if self.context_cache:
+                # Re-read so the cached row carries the database defaults (id, timestamps)
+                result = conn.execute(
+                    'SELECT * FROM users WHERE user_id = ?', (user_id,)
+                ).fetchone()
+                self.context_cache.set_user(user_id, dict(result) if result else None)
     
     def get_user_messages(self, user_id, limit=50):
-        """Get conversation history for user"""
-        with self.get_connection() as conn:
+        """Get conversation history for user, reading through to the archive"""
+        if not self.context_cache:
+            return self._read_user_messages(user_id, limit)[-limit:] if limit else []
+        
+        cached = self.context_cache.get_messages(user_id, limit)
+        if cached is not None:
+            return cached
+        # Fill the whole ring buffer so later, smaller reads are served from memory
+        fetch = max(limit, self.context_cache.history_size)
+        with self.context_cache.user_lock(user_id):
+            messages = self._read_user_messages(user_id, fetch)
+            self.context_cache.set_messages(user_id, messages, complete=len(messages) < fetch)
+        return messages[-limit:] if limit else []
+    
+    def _read_user_messages(self, user_id, fetch):
+        """Newest fetch messages for user, oldest first, topped up from the archive"""
+        with self._user_reader(user_id) as conn:
             results = conn.execute('''
                 SELECT role, content, timestamp FROM messages 
                 WHERE user_id = ? 
-                ORDER BY timestamp DESC LIMIT ?
-            ''', (user_id, limit)).fetchall()
-            return [dict(row) for row in reversed(results)]
+                ORDER BY timestamp DESC, id DESC LIMIT ?
+            ''', (user_id, fetch)).fetchall()
+            messages = [dict(row) for row in reversed(results)]
+        
+        if self.archive_path and len(messages) < fetch:
+            older = self._get_archived_messages(user_id, fetch - len(messages))
+            messages = older + messages
+        return messages
+    
+    def _get_archived_messages(self, user_id, limit):
+        """Read up to limit of the user's newest archived messages, returned oldest first"""
+        collected = []
+        with self.get_archive_connection() as conn:
+            blocks = conn.execute('''
+                SELECT payload FROM message_archive
+                WHERE user_id = ?
+                ORDER BY last_timestamp DESC, id DESC
+            ''', (user_id,))
+            for block in blocks:
+                collected = json.loads(zlib.decompress(block['payload'])) + collected
+                if len(collected) >= limit:
+                    break
+        return collected[-limit:] if limit else []
+    
+    def archive_messages(self, older_than_days, batch_size=5000, block_size=500):
+        """
+        Move messages older than the cutoff into compressed per-user archive blocks.
+        Works through each store in id-ordered batches of batch_size, committing each,
+        so memory stays bounded; blocks hold at most block_size messages to keep
+        read-through decompression small.
+        """
+        if not self.archive_path:
+            return 0
+        
+        cutoff = (datetime.utcnow() - timedelta(days=int(older_than_days))).strftime('%Y-%m-%d %H:%M:%S')
+        return sum(self._archive_store(connect, cutoff, batch_size, block_size)
+                   for _, connect in self._user_stores())
+    
+    def _archive_store(self, connect, cutoff, batch_size, block_size):
+        archived, users, last_id = 0, set(), 0
+        while True:
+            with connect() as conn:
+                rows = conn.execute('''
+                    SELECT id, user_id, role, content, timestamp FROM messages
+                    WHERE id > ? AND timestamp < ?
+                    ORDER BY id LIMIT ?
+                ''', (last_id, cutoff, batch_size)).fetchall()
+                if not rows:
+                    break
+                
+                by_user = {}
+                for row in sorted(rows, key=lambda r: (r['user_id'], r['timestamp'], r['id'])):
+                    by_user.setdefault(row['user_id'], []).append(
+                        {'role': row['role'], 'content': row['content'], 'timestamp': row['timestamp']}
+                    )
+                blocks = [(user_id, msgs[i:i + block_size])
+                          for user_id, msgs in by_user.items()
+                          for i in range(0, len(msgs), block_size)]
+                
+                # Archive is committed before the hot rows are deleted, so a crash
+                # in between leaves duplicates rather than losing history
+                with self.get_archive_connection() as archive:
+                    archive.executemany('''
+                        INSERT INTO message_archive
+                        (user_id, first_timestamp, last_timestamp, message_count, payload)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', [
+                        (user_id, msgs[0]['timestamp'], msgs[-1]['timestamp'], len(msgs),
+                         zlib.compress(json.dumps(msgs).encode('utf-8'), 6))
+                        for user_id, msgs in blocks
+                    ])
+                    archive.commit()
+                
+                batch_max = rows[-1]['id']
+                conn.execute('''
+                    DELETE FROM messages
+                    WHERE id > ? AND id <= ? AND timestamp < ?
+                ''', (last_id, batch_max, cutoff))
+                conn.commit()
+            
+            archived += len(rows)
+            users.update(by_user)
+            last_id = batch_max
+            if len(rows) < batch_size:
+                break
+        
+        if archived:
+            logger.info(f"Archived {archived} messages for {len(users)} users")
+        return archived
+    
+    def parse_cursor(self, table, cursor):
+        """
+        Validate an export resume cursor. Sharded per-user tables use "<shard>:<id>"
+        because row ids are only unique within a shard; everything else is a plain id.
+        """
+        if cursor in (None, ''):
+            return None
+        if self.shards and table in USER_TABLES:
+            shard, _, row_id = str(cursor).partition(':')
+            shard, row_id = int(shard), int(row_id)
+            if not 0 <= shard < len(self.shards):
+                raise ValueError(f"cursor shard out of range: {shard}")
+            return shard, row_id
+        return int(cursor)
+    
+    def iter_table(self, table, time_column='created_at', since=None, until=None,
+                   after_id=None, filters=None, chunk_size=1000):
+        """Stream rows in id order without loading the table into memory"""
+        if not (self.shards and table in USER_TABLES):
+            yield from self._iter_rows(self.get_connection, table, time_column, since, until,
+                                       after_id, filters, chunk_size)
+            return
+        
+        # Cross-shard: walk shards in order, tagging rows so a cursor can resume mid-shard
+        start_shard, start_id = after_id if after_id is not None else (0, None)
+        for shard in self.shards[start_shard:]:
+            after = start_id if shard.index == start_shard else None
+            for row in self._iter_rows(shard.connection, table, time_column, since, until,
+                                       after, filters, chunk_size):
+                row['shard'] = shard.index
+                yield row
+    
+    def _iter_rows(self, connect, table, time_column, since, until, after_id, filters, chunk_size):
+        clauses, params = [], []
+        if since:
+            clauses.append(f'{time_column} >= ?')
+            params.append(since)
+        if until:
+            clauses.append(f'{time_column} < ?')
+            params.append(until)
+        for column, value in (filters or {}).items():
+            clauses.append(f'{column} = ?')
+            params.append(value)
+        
+        # One short keyset query per chunk, releasing the connection in between:
+        # a slow consumer must not hold a read lock that blocks writers
+        last_id = after_id
+        while True:
+            # Callers pass table/column names from a whitelist; values are bound
+            where = clauses + (['id > ?'] if last_id is not None else [])
+            args = params + ([last_id] if last_id is not None else [])
+            with connect() as conn:
+                rows = [dict(row) for row in conn.execute(
+                    f"SELECT * FROM {table} {'WHERE ' + ' AND '.join(where) if where else ''} "
+                    f"ORDER BY id LIMIT ?", args + [chunk_size]
+                ).fetchall()]
+            yield from rows
+            if len(rows) < chunk_size:
+                return
+            last_id = rows[-1]['id']
+    
+    def rollup_sources(self, table):
+        """(watermark key, connect) per store holding table; shards are separate sources"""
+        if self.shards and table in USER_TABLES:
+            return [(f'{table}@{shard.index}', shard.connection) for shard in self.shards]
+        return [(table, self.get_connection)]
+    
+    def iter_new_rows(self, table, watermarks, chunk_size=1000):
+        """Yield (source, row) for rows past each source's watermark id"""
+        for source, connect in self.rollup_sources(table):
+            for row in self._iter_rows(connect, table, None, None, None,
+                                       watermarks.get(source), None, chunk_size):
+                yield source, row
+    
+    def get_rollup_watermarks(self):
+        with self.get_connection() as conn:
+            results = conn.execute('SELECT source, last_id FROM rollup_watermarks').fetchall()
+            return {row['source']: row['last_id'] for row in results}
+    
+    def apply_rollup(self, increments, watermarks, gauges=None):
+        """Add hourly counts and advance watermarks in one transaction"""
+        with self.get_connection() as conn:
+            conn.executemany('''
+                INSERT INTO stats_hourly (metric, day, hour, dimension, count)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (metric, day, hour, dimension) DO UPDATE SET
+                    count = count + excluded.count
+            ''', [(metric, day, hour, dimension, n)
+                  for (metric, day, hour, dimension), n in increments.items()])
+            conn.executemany('''
+                INSERT OR REPLACE INTO rollup_watermarks (source, last_id) VALUES (?, ?)
+            ''', list(watermarks.items()))
+            conn.executemany('''
+                INSERT OR REPLACE INTO stats_gauges (name, value, updated_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+            ''', list((gauges or {}).items()))
+            conn.commit()
+    
+    def replace_rollup_watermarks(self, table, watermarks):
+        """Drop every watermark for table (any shard layout) and store the given ones"""
+        with self.get_connection() as conn:
+            conn.execute('DELETE FROM rollup_watermarks WHERE source = ? OR source LIKE ?',
+                         (table, f'{table}@%'))
+            conn.executemany('INSERT INTO rollup_watermarks (source, last_id) VALUES (?, ?)',
+                             list(watermarks.items()))
+            conn.commit()
+    
+    def count_active_customers(self):
+        with self.get_connection() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM customers WHERE status = 'active'"
+            ).fetchone()[0]
+    
+    def get_daily_stats(self, days=30):
+        """Per-day totals by metric and dimension for the last N days, from rollups only"""
+        with self.get_connection() as conn:
+            results = conn.execute('''
+                SELECT metric, day, dimension, SUM(count) AS count FROM stats_hourly
+                WHERE day >= date('now', ?)
+                GROUP BY metric, day, dimension
+                ORDER BY metric, day
+            ''', (f'-{int(days)} days',)).fetchall()
+            return [dict(row) for row in results]
+    
+    def get_hourly_stats(self, metric, day):
+        with self.get_connection() as conn:
+            results = conn.execute('''
+                SELECT hour, dimension, count FROM stats_hourly
+                WHERE metric = ? AND day = ? ORDER BY hour
+            ''', (metric, day)).fetchall()
+            return [dict(row) for row in results]
+    
+    def get_gauges(self):
+        with self.get_connection() as conn:
+            results = conn.execute('SELECT name, value, updated_at FROM stats_gauges').fetchall()
+            return {row['name']: {'value': row['value'], 'updated_at': row['updated_at']}
+                    for row in results}
+    
+    def get_sync_watermark(self, name):
+        with self.get_connection() as conn:
+            row = conn.execute('SELECT value FROM sync_watermarks WHERE name = ?', (name,)).fetchone()
+            return row['value'] if row else None
+    
+    def set_sync_watermark(self, name, value):
+        with self.get_connection() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO sync_watermarks (name, value, updated_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+            ''', (name, value))
+            conn.commit()
+    
+    def ping(self):
+        """Cheap liveness check for the main file and every shard"""
+        with self.get_connection() as conn:
+            conn.execute('SELECT 1').fetchone()
+        for shard in self.shards:
+            with shard.connection() as conn:
+                conn.execute('SELECT 1').fetchone()
+    
+    def count_rows(self, table):
+        """Row count for a table, summed across shards for per-user tables"""
+        if self.shards and table in USER_TABLES:
+            total = 0
+            for shard in self.shards:
+                with shard.connection() as conn:
+                    total += conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+            return total
+        with self.get_connection() as conn:
+            return conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+    
+    def compact(self, full=False, step_pages=1000):
+        """
+        Return free pages left by archival to the filesystem. Files in incremental
+        auto-vacuum mode are trimmed in short incremental_vacuum steps; a full VACUUM
+        (exclusive lock, whole-file rewrite) only runs when full is set, and also
+        switches an older file over to incremental mode.
+        """
+        for path in [self.db_path] + [shard.path for shard in self.shards]:
+            conn = sqlite3.connect(path, isolation_level=None, timeout=30)
+            try:
+                if full:
+                    conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+                    conn.execute('VACUUM')
+                    continue
+                if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                    logger.debug(f"Skipping compaction of {path}: not in incremental auto-vacuum mode")
+                    continue
+                # Each step is its own short write transaction
+                while conn.execute('PRAGMA freelist_count').fetchone()[0]:
+                    conn.execute(f'PRAGMA incremental_vacuum({int(step_pages)})').fetchall()
+            finally:
+                conn.close()
     
     def add_message(self, user_id, role, content):
         """Add message to conversation history"""
+        timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        with self._cache_lock(user_id):
+            with self._user_writer(user_id) as conn:
+                conn.execute('''
+                    INSERT INTO messages (user_id, role, content, timestamp)
+                    VALUES (?, ?, ?, ?)
+                ''', (user_id, role, content, timestamp))
+                conn.commit()
+            if self.context_cache:
+                self.context_cache.append_message(
+                    user_id, {'role': role, 'content': content, 'timestamp': timestamp}
+                )
+    
+    def record_llm_usage(self, user_key, provider, model, prompt_tokens, completion_tokens,
+                         estimated=False):
+        """Append one LLM call to the usage ledger and bump the daily rollup"""
         with self.get_connection() as conn:
             conn.execute('''
-                INSERT INTO messages (user_id, role, content)
-                VALUES (?, ?, ?)
-            ''', (user_id, role, content))
+                INSERT INTO llm_usage
+                (user_key, provider, model, prompt_tokens, completion_tokens, estimated)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (user_key, provider, model, prompt_tokens, completion_tokens, int(estimated)))
+            conn.execute('''
+                INSERT INTO llm_usage_daily
+                (user_key, day, provider, model, requests, prompt_tokens, completion_tokens)
+                VALUES (?, date('now'), ?, ?, 1, ?, ?)
+                ON CONFLICT (user_key, day, provider, model) DO UPDATE SET
+                    requests = requests + 1,
+                    prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                    completion_tokens = completion_tokens + excluded.completion_tokens
+            ''', (user_key, provider, model, prompt_tokens, completion_tokens))
             conn.commit()
     
+    def get_daily_token_usage(self, user_key):
+        """Total tokens used today (UTC) by user_key, across providers and models"""
+        with self.get_connection() as conn:
+            result = conn.execute('''
+                SELECT COALESCE(SUM(prompt_tokens + completion_tokens), 0) AS tokens
+                FROM llm_usage_daily WHERE user_key = ? AND day = date('now')
+            ''', (user_key,)).fetchone()
+            return result['tokens']
+    
+    def get_usage_rollup(self, day=None, limit=50):
+        """Heaviest users for a day, broken down by provider and model"""
+        with self.get_connection() as conn:
+            results = conn.execute('''
+                SELECT user_key, provider, model, requests, prompt_tokens, completion_tokens
+                FROM llm_usage_daily WHERE day = COALESCE(?, date('now'))
+                ORDER BY prompt_tokens + completion_tokens DESC LIMIT ?
+            ''', (day, limit)).fetchall()
+            return [dict(row) for row in results]
+    
+    def record_llm_calls(self, rows):
+        """Bulk-append LLM attempt records (dicts keyed by llm_calls column names)"""
+        if not rows:
+            return
+        columns = ('created_at', 'provider', 'model', 'route', 'status', 'fallback', 'queue_ms',
+                   'ttfb_ms', 'total_ms', 'prompt_tokens', 'completion_tokens', 'cached_tokens')
+        with self.get_connection() as conn:
+            conn.executemany(
+                f"INSERT INTO llm_calls ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                [tuple(row.get(c) for c in columns) for row in rows],
+            )
+            conn.commit()
+    
+    def get_llm_calls_after(self, last_id, limit=5000):
+        with self.get_connection() as conn:
+            results = conn.execute(
+                'SELECT * FROM llm_calls WHERE id > ? ORDER BY id LIMIT ?', (last_id or 0, limit)
+            ).fetchall()
+            return [dict(row) for row in results]
+    
+    def apply_llm_call_rollup(self, increments, last_id):
+        """Merge hourly increments (counters summed, histograms added bucket-wise) and advance the watermark"""
+        with self.get_connection() as conn:
+            for key, inc in increments.items():
+                row = conn.execute('''
+                    SELECT * FROM llm_calls_hourly
+                    WHERE hour = ? AND provider = ? AND model = ? AND route = ?
+                ''', key).fetchone()
+                merged = dict(inc)
+                if row:
+                    for column, value in inc.items():
+                        if column.endswith('_hist'):
+                            old = json.loads(row[column] or '[]')
+                            old += [0] * (len(value) - len(old))
+                            merged[column] = [a + b for a, b in zip(old, value)]
+                        else:
+                            merged[column] = (row[column] or 0) + value
+                for column in ('latency_hist', 'ttfb_hist'):
+                    merged[column] = json.dumps(merged.get(column) or [])
+                columns = list(merged)
+                conn.execute(f'''
+                    INSERT OR REPLACE INTO llm_calls_hourly (hour, provider, model, route, {', '.join(columns)})
+                    VALUES (?, ?, ?, ?, {', '.join('?' * len(columns))})
+                ''', (*key, *(merged[c] for c in columns)))
+            conn.execute('''
+                INSERT OR REPLACE INTO sync_watermarks (name, value, updated_at)
+                VALUES ('llm_calls', ?, CURRENT_TIMESTAMP)
+            ''', (last_id,))
+            conn.commit()
+    
+    def get_llm_call_rollups(self, since_hour):
+        with self.get_connection() as conn:
+            results = conn.execute(
+                'SELECT * FROM llm_calls_hourly WHERE hour >= ? ORDER BY hour', (since_hour,)
+            ).fetchall()
+            return [dict(row) for row in results]
+    
+    def prune_llm_calls(self, days):
+        """Drop raw attempt records past the retention period once they are in the hourly rollup"""
+        with self.get_connection() as conn:
+            cursor = conn.execute('''
+                DELETE FROM llm_calls WHERE created_at < datetime('now', ?)
+                AND id <= COALESCE((SELECT value FROM sync_watermarks WHERE name = 'llm_calls'), 0)
+            ''', (f'-{int(days)} days',))
+            conn.commit()
+            return cursor.rowcount
+    
     def create_customer(self, email, name, subscription_id=None, **kwargs):
         """Create paying customer"""
         with self.get_connection() as conn:
+            # Update in place (not REPLACE) so id and created_at survive and rollups don't recount the row
             conn.execute('''
-                INSERT OR REPLACE INTO customers 
+                INSERT INTO customers 
                 (email, name, subscription_id, fitness_goals, experience_level)
                 VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (email) DO UPDATE SET
+                    name = excluded.name,
+                    subscription_id = excluded.subscription_id,
+                    status = excluded.status,
+                    monthly_amount = excluded.monthly_amount,
+                    fitness_goals = excluded.fitness_goals,
+                    experience_level = excluded.experience_level
             ''', (email, name, subscription_id, 
                   kwargs.get('fitness_goals'), kwargs.get('experience_level')))
             conn.commit()
@@ -182,6 +923,18 @@ class Database:
             ''', (topic, question, answer, category, source))
             conn.commit()
     
+    def add_knowledge_bulk(self, items):
+        """Insert many knowledge base entries in one transaction"""
+        with self.get_connection() as conn:
+            conn.executemany('''
+                INSERT INTO knowledge_base (topic, question, answer, category, source)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(item['topic'], item['question'], item['answer'],
+                   item.get('category', 'general'), item.get('source', 'manual'))
+                  for item in items])
+            conn.commit()
+        logger.info(f"Added {len(items)} knowledge base entries")
+    
     def search_knowledge(self, query, limit=5):
         """Search knowledge base"""
         with self.get_connection() as conn:
@@ -196,12 +949,93 @@ class Database:
     def create_lead(self, email, **kwargs):
         """Create lead from form submission"""
         with self.get_connection() as conn:
+            # Update in place (not REPLACE) so id and created_at survive and rollups don't recount the row
             conn.execute('''
-                INSERT OR REPLACE INTO leads 
+                INSERT INTO leads 
                 (email, name, phone, goals, experience, message, source, ai_response)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (email) DO UPDATE SET
+                    name = excluded.name,
+                    phone = excluded.phone,
+                    goals = excluded.goals,
+                    experience = excluded.experience,
+                    message = excluded.message,
+                    source = excluded.source,
+                    status = excluded.status,
+                    ai_response = excluded.ai_response
             ''', (email, kwargs.get('name'), kwargs.get('phone'), 
                   kwargs.get('goals'), kwargs.get('experience'), 
                   kwargs.get('message'), kwargs.get('source'), 
                   kwargs.get('ai_response')))
             conn.commit()
+
+
+def rebalance_shards(db_path, old_count, new_count, batch_size=1000):
+    """
+    Copy users and messages from the old shard layout into a new one. Counts of 0
+    or 1 mean "unsharded" (the tables in db_path). Run with the app stopped, then
+    switch SHARD_COUNT; the old files are left in place for rollback.
+    
+    Copied rows get new ids, so analytics watermarks are migrated: rows the rollup
+    has already counted are copied first and each target store's watermark is set
+    past them, then the uncounted rows follow. Rolling back means rebalancing again.
+    """
+    if old_count == new_count or (old_count <= 1 and new_count <= 1):
+        raise ValueError("old and new layouts are the same")
+    
+    source = Database(db_path, shard_count=old_count)
+    target = Database(db_path, shard_count=new_count)
+    if new_count <= 1 and (target.count_rows('users') or target.count_rows('messages')):
+        raise ValueError("unsharded target already holds users/messages")
+    if new_count > 1 and any(target.count_rows(t) for t in USER_TABLES):
+        raise ValueError(f"target shard files for {new_count} shards are not empty")
+    
+    watermarks = source.get_rollup_watermarks()
+    copied = {'users': 0, 'messages': 0}
+    for table, columns in (('users', 'user_id, name, email, goal, source, created_at, updated_at'),
+                           ('messages', 'user_id, role, content, timestamp')):
+        placeholders = ', '.join('?' for _ in columns.split(','))
+        pending = {}
+        
+        def flush():
+            for index, rows in pending.items():
+                connect = target.shards[index].writer if target.shards else target.get_connection
+                with connect() as conn:
+                    conn.executemany(
+                        f'INSERT INTO {table} ({columns}) VALUES ({placeholders})', rows
+                    )
+                    conn.commit()
+                copied[table] += len(rows)
+            pending.clear()
+        
+        def copy(counted):
+            for key, connect in source.rollup_sources(table):
+                last_id = watermarks.get(key)
+                if last_id is None and counted:
+                    continue
+                where = '' if last_id is None else ('WHERE id <= ?' if counted else 'WHERE id > ?')
+                with connect() as conn:
+                    cursor = conn.execute(f'SELECT {columns} FROM {table} {where} ORDER BY id',
+                                          () if last_id is None else (last_id,))
+                    while True:
+                        rows = cursor.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        for row in rows:
+                            index = shard_index(row['user_id'], new_count) if target.shards else None
+                            pending.setdefault(index, []).append(tuple(row))
+                        flush()
+        
+        tracked = any(key in watermarks for key, _ in source.rollup_sources(table))
+        copy(counted=True)
+        if tracked:
+            moved = {}
+            for key, connect in target.rollup_sources(table):
+                with connect() as conn:
+                    moved[key] = conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}').fetchone()[0]
+            target.replace_rollup_watermarks(table, moved)
+        copy(counted=False)
+    
+    logger.info(f"Rebalanced {copied['users']} users and {copied['messages']} messages "
+                f"from {old_count} to {new_count} shards")
+    return copied
@@ -1,21 +1,40 @@
 # main.py — WillpowerFitness Portal API (Checkout Sessions model) + security headers + rate limit
 
-import os, re, json, logging, requests
+import os, re, json, hmac, uuid, random, logging, requests
 from datetime import datetime
-from time import time
+from time import time, perf_counter, sleep
 from collections import defaultdict
 from typing import Optional
+from functools import wraps
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
 import stripe
-from supabase import create_client, Client
+from supabase import Client
 
 # ----- Local modules (unchanged) -----
-from config import Config, setup_logging
-from database import Database
+from config import Config, setup_logging, request_id_var
+from database import Database, UserContextCache, USER_TABLES
 from services.ai_service import AIService
 from services.payment_service import PaymentService  # kept for compatibility
+from services.retention_service import RetentionService
+from services.export_service import ExportService
+from services.prompt_builder import build_messages, prompt_cache_stats
+from services.deadline import Deadline, DeadlineExceeded
+from services.supabase_repository import SupabaseRepository, create_supabase_client
+from services.admission import AdmissionPool, Overloaded
+from services.usage_ledger import UsageLedger, QuotaExceeded
+from services.analytics_service import AnalyticsService
+from services.health_service import HealthProber
+from services.response_middleware import ResponseOptimizer
+from services.batch_service import BatchChat, save_to_knowledge
+from services.traffic_capture import TrafficCapture
+from services.profiler import SamplingProfiler
+from services.checkout_cache import CheckoutSessionCache
+from services.reconciliation_service import ReconciliationService
+from services.model_router import ModelRouter
+from services.fault_injection import FaultInjector, InjectedFault, InjectedTimeout
+from services.llm_telemetry import LLMTelemetry, CallTrace
 
 # ---------------- ENV ----------------
 SUPABASE_URL   = os.getenv("SUPABASE_URL", "")
@@ -37,30 +56,57 @@ PRINTFUL_TSHIRT_VARIANT_ID = os.getenv("PRINTFUL_TSHIRT_VARIANT_ID")
 
 FRONTEND_ORIGIN = (os.getenv("FRONTEND_ORIGIN") or "https://app.willpowerfitnessai.com").rstrip("/")
 
+ADMIN_API_TOKEN = (os.getenv("ADMIN_API_TOKEN") or "").strip()  # bearer token for /api/admin/*
+
+# Queued, rotating logging must be in place before anything logs
+setup_logging()
+logger = logging.getLogger(__name__)
+
 # Log presence of critical envs (not values)
-logging.getLogger().setLevel(logging.INFO)
 logging.info("SUPABASE_URL set? %s", bool(SUPABASE_URL))
 logging.info("SUPABASE_KEY set? %s", bool(SUPABASE_KEY))
 logging.info("STRIPE_SECRET_KEY set? %s", bool(STRIPE_SECRET_KEY))
 logging.info("STRIPE_WEBHOOK_SECRET set? %s", bool(STRIPE_WEBHOOK_SECRET))
 logging.info("Stripe PRICE_ID present? %s", bool(PRICE_ID))
 logging.info("FRONTEND_ORIGIN: %s", FRONTEND_ORIGIN)
+logging.info("ADMIN_API_TOKEN set? %s", bool(ADMIN_API_TOKEN))
+
+# Fault injection for load/chaos testing; rules can only be set outside production
+fault_injector = FaultInjector(allowed=Config.APP_ENV != "production")
+if Config.FAULT_INJECTION:
+    try:
+        fault_injector.set_rules(Config.FAULT_INJECTION)
+    except (PermissionError, ValueError) as e:
+        logging.error(f"FAULT_INJECTION ignored: {e}")
 
 # Stripe
 if STRIPE_SECRET_KEY:
     stripe.api_key = STRIPE_SECRET_KEY
 
-# Supabase client
+def _stripe_call(fn, *args, **kwargs):
+    """Stripe API call under fault injection; injected faults surface as Stripe errors"""
+    try:
+        return fault_injector.call("stripe", fn, *args, **kwargs)
+    except InjectedTimeout as e:
+        raise stripe.error.APIConnectionError(str(e))
+    except InjectedFault as e:
+        raise stripe.error.APIError(str(e), http_status=int(e.code) if e.code else None)
+
+# Supabase client (all table access goes through the repository sb)
 supabase: Optional[Client] = None
 if SUPABASE_URL and SUPABASE_KEY:
     try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+        supabase = create_supabase_client(
+            SUPABASE_URL, SUPABASE_KEY,
+            timeout=Config.SUPABASE_TIMEOUT_SECONDS,
+            pool_size=Config.SUPABASE_POOL_SIZE,
+        )
     except Exception as e:
         logging.error(f"Supabase init failed: {e}")
+sb = SupabaseRepository(supabase, max_retries=Config.SUPABASE_MAX_RETRIES,
+                        max_workers=Config.SUPABASE_POOL_SIZE, fault_injector=fault_injector)
 
 # Config validation
-setup_logging()
-logger = logging.getLogger(__name__)
 try:
     Config.validate_required_keys()
 except ValueError as e:
@@ -68,64 +114,219 @@ except ValueError as e:
     raise SystemExit(1)
 
 # ---------------- LLM HELPERS (OpenAI first, fallback to Groq) ----------------
-def _call_openai(messages: list[dict]) -> Optional[str]:
-    if not OPENAI_API_KEY:
-        return None
+# Every attempt takes its timeout from the request's Deadline; attempts that
+# cannot get LLM_MIN_ATTEMPT_SECONDS are skipped instead of started.
+def _new_deadline(header_value: Optional[str] = None) -> Deadline:
+    return Deadline.from_header(
+        header_value,
+        default_seconds=Config.LLM_DEADLINE_SECONDS,
+        max_seconds=Config.LLM_MAX_DEADLINE_SECONDS,
+        min_attempt_seconds=Config.LLM_MIN_ATTEMPT_SECONDS,
+    )
+
+def _chat_completion(provider: str, url: str, api_key: str, model: str, messages: list[dict],
+                     timeout: float, max_tokens: Optional[int], user_key: Optional[str],
+                     trace: CallTrace) -> Optional[str]:
+    """One OpenAI-compatible completion attempt, recorded to telemetry whatever the outcome"""
+    body = {"model": model, "messages": messages, "temperature": 0.3}
+    if max_tokens:
+        body["max_tokens"] = max_tokens
+    start = perf_counter()
+    ttfb_ms = None
     try:
-        r = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers={"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"},
-            json={"model": "gpt-4o-mini", "messages": messages, "temperature": 0.3},
-            timeout=30,
+        # stream=True returns once headers arrive, which gives time-to-first-byte
+        r = fault_injector.post(
+            provider, url,
+            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+            json=body,
+            timeout=timeout,
+            stream=True,
         )
+        ttfb_ms = (perf_counter() - start) * 1000
         if r.status_code >= 400:
-            logger.warning("OpenAI error %s: %s", r.status_code, r.text[:300])
+            trace.record(provider, model, f"http_{r.status_code}", (perf_counter() - start) * 1000, ttfb_ms)
+            logger.warning("%s error (%s) %s: %s", provider, model, r.status_code, r.text[:300])
             return None
         j = r.json()
-        return ((j.get("choices") or [{}])[0].get("message", {}) or {}).get("content")
+        usage = j.get("usage")
+        out = ((j.get("choices") or [{}])[0].get("message", {}) or {}).get("content")
+        trace.record(provider, model, "ok" if out else "empty", (perf_counter() - start) * 1000, ttfb_ms, usage)
+        prompt_cache_stats.record(provider, model, usage)
+        usage_ledger.record(user_key, provider, model, usage, messages, out)
+        return out
+    except requests.exceptions.Timeout as e:
+        trace.record(provider, model, "timeout", (perf_counter() - start) * 1000, ttfb_ms)
+        logger.warning("%s call timed out (%s): %s", provider, model, e)
     except Exception as e:
-        logger.warning("OpenAI call failed: %s", e)
+        trace.record(provider, model, "error", (perf_counter() - start) * 1000, ttfb_ms)
+        logger.warning("%s call failed (%s): %s", provider, model, e)
+    return None
+
+def _call_openai(messages: list[dict], deadline: Optional[Deadline] = None,
+                 user_key: Optional[str] = None, model: str = "gpt-4o-mini",
+                 max_tokens: Optional[int] = None, trace: Optional[CallTrace] = None) -> Optional[str]:
+    if not OPENAI_API_KEY:
         return None
+    deadline = deadline or _new_deadline()
+    timeout = deadline.timeout(30)
+    if timeout is None:
+        logger.warning("OpenAI skipped: deadline budget exhausted")
+        return None
+    return _chat_completion("openai", "https://api.openai.com/v1/chat/completions", OPENAI_API_KEY,
+                            model, messages, timeout, max_tokens, user_key, trace or llm_telemetry.trace())
 
-def _call_groq(messages: list[dict]) -> Optional[str]:
+def _call_groq(messages: list[dict], deadline: Optional[Deadline] = None,
+               user_key: Optional[str] = None,
+               models: tuple = ("llama-3.1-70b-versatile", "llama3-70b-8192"),
+               max_tokens: Optional[int] = None, trace: Optional[CallTrace] = None) -> Optional[str]:
     if not GROQ_API_KEY:
         return None
-    models = ("llama-3.1-70b-versatile", "llama3-70b-8192")
+    deadline = deadline or _new_deadline()
+    trace = trace or llm_telemetry.trace()
     for model in models:
-        try:
-            r = requests.post(
-                "https://api.groq.com/openai/v1/chat/completions",
-                headers={"Authorization": f"Bearer {GROQ_API_KEY}", "Content-Type": "application/json"},
-                json={"model": model, "messages": messages, "temperature": 0.3},
-                timeout=30,
-            )
-            if r.status_code >= 400:
-                logger.warning("Groq error (%s) %s: %s", model, r.status_code, r.text[:300])
-                continue
-            j = r.json()
-            out = ((j.get("choices") or [{}])[0].get("message", {}) or {}).get("content")
-            if out:
-                return out
-        except Exception as e:
-            logger.warning("Groq call failed (%s): %s", model, e)
+        timeout = deadline.timeout(30)
+        if timeout is None:
+            logger.warning("Groq (%s) skipped: deadline budget exhausted", model)
+            break
+        out = _chat_completion("groq", "https://api.groq.com/openai/v1/chat/completions", GROQ_API_KEY,
+                               model, messages, timeout, max_tokens, user_key, trace)
+        if out:
+            return out
+    return None
+
+# Simple turns go to the fastest small model, complex ones get a larger completion budget (see ModelRouter)
+model_router = ModelRouter.from_env(
+    Config.MODEL_ROUTES,
+    fast_max_words=Config.ROUTER_FAST_MAX_WORDS,
+    complex_min_words=Config.ROUTER_COMPLEX_MIN_WORDS,
+)
+
+def _call_model(provider: str, model: str, messages: list[dict], deadline: Deadline,
+                user_key: Optional[str], max_tokens: int, trace: CallTrace) -> Optional[str]:
+    if provider == "openai":
+        return _call_openai(messages, deadline, user_key, model=model, max_tokens=max_tokens, trace=trace)
+    if provider == "groq":
+        return _call_groq(messages, deadline, user_key, models=(model,), max_tokens=max_tokens, trace=trace)
+    logger.warning("Unknown provider in model route: %s", provider)
     return None
 
-def _llm_chat(messages: list[dict]) -> str:
-    out = _call_openai(messages)
-    if out:
-        return out.strip()
-    out = _call_groq(messages)
-    if out:
-        return out.strip()
+def _provider_configured(provider: str) -> bool:
+    return bool({"openai": OPENAI_API_KEY, "groq": GROQ_API_KEY}.get(provider))
+
+def _llm_chat(messages: list[dict], deadline: Optional[Deadline] = None,
+              user_key: Optional[str] = None, route: Optional[str] = None,
+              queue_ms: float = 0.0) -> str:
+    deadline = deadline or _new_deadline()
+    route = route or model_router.classify_messages(messages)
+    table = model_router.route(route)
+    # Raises QuotaExceeded before any provider is called
+    usage_ledger.check(user_key, messages, max_tokens=table["max_tokens"])
+    # Only providers with a key can be called at all; among those, skip the ones the
+    # background prober currently sees as down (unless every configured one is)
+    configured = [c for c in enumerate(table["candidates"]) if _provider_configured(c[1][0])]
+    available = [c for c in configured if not health.is_down(c[1][0])] or configured
+    trace = llm_telemetry.trace(route, queue_ms)
+    start = perf_counter()
+    for index, (provider, model) in available:
+        out = _call_model(provider, model, messages, deadline, user_key, table["max_tokens"], trace)
+        if out:
+            model_router.record(route, (perf_counter() - start) * 1000, index)
+            return out.strip()
+    model_router.record(route, (perf_counter() - start) * 1000, ok=False)
+    if deadline.timeout(30) is None:
+        raise DeadlineExceeded("deadline_exceeded")
     raise RuntimeError("no_model_available")
 
+# ---------------- ADMISSION POOLS ----------------
+# LLM calls are capped so a provider brownout cannot tie up every worker thread;
+# checkout and the Stripe webhook are admitted from a separate pool.
+llm_pool = AdmissionPool(
+    "llm",
+    max_inflight=Config.ADMISSION_LLM_MAX_INFLIGHT,
+    max_queue=Config.ADMISSION_LLM_MAX_QUEUE,
+    member_reserve=Config.ADMISSION_MEMBER_RESERVE,
+    member_wait_seconds=Config.ADMISSION_MEMBER_WAIT_SECONDS,
+    anon_wait_seconds=Config.ADMISSION_ANON_WAIT_SECONDS,
+    retry_after_seconds=Config.ADMISSION_RETRY_AFTER_SECONDS,
+)
+payments_pool = AdmissionPool(
+    "payments",
+    max_inflight=Config.ADMISSION_PAYMENTS_MAX_INFLIGHT,
+    max_queue=Config.ADMISSION_PAYMENTS_MAX_INFLIGHT,
+    member_wait_seconds=Config.ADMISSION_MEMBER_WAIT_SECONDS,
+    retry_after_seconds=Config.ADMISSION_RETRY_AFTER_SECONDS,
+)
+PAYMENT_PATHS = ("/api/checkout", "/api/webhooks/stripe")
+
+def _overloaded(e: Overloaded):
+    resp = jsonify(error="overloaded", pool=e.pool)
+    resp.status_code = 503
+    resp.headers["Retry-After"] = str(e.retry_after)
+    return resp
+
 # ---------------- APP ----------------
 app = Flask(__name__)
 app.url_map.strict_slashes = False  # /x and /x/ are treated the same
 
+# ---- Request id for log correlation ----
+@app.before_request
+def assign_request_id():
+    rid = (request.headers.get("X-Request-ID") or "").strip()[:64] or uuid.uuid4().hex
+    request_id_var.set(rid)
+
+# ---- Opt-in traffic capture (sanitized) for offline replay ----
+traffic_capture = (
+    TrafficCapture(Config.TRAFFIC_CAPTURE_PATH, Config.TRAFFIC_CAPTURE_SAMPLE_RATE,
+                   max_queue=Config.TRAFFIC_CAPTURE_MAX_QUEUE)
+    if Config.TRAFFIC_CAPTURE_PATH else None
+)
+
+@app.before_request
+def start_capture():
+    if traffic_capture and traffic_capture.wants(request.path):
+        request.get_data(cache=True)  # keep the raw body readable after the view
+        g.capture_start = perf_counter()
+
+@app.after_request
+def finish_capture(resp):
+    start = g.pop("capture_start", None)
+    if start is not None:
+        try:
+            traffic_capture.record(request, resp.status_code, (perf_counter() - start) * 1000)
+        except Exception as e:
+            logger.warning("traffic capture failed: %s", e)
+    return resp
+
+# ---- On-demand sampling profiler (X-Profile: <PROFILE_SECRET>, or a sampled share) ----
+profiler = SamplingProfiler(interval_ms=Config.PROFILE_INTERVAL_MS)
+
+def _wants_profile() -> bool:
+    secret = request.headers.get("X-Profile", "")
+    if secret and Config.PROFILE_SECRET:
+        return hmac.compare_digest(secret.encode(), Config.PROFILE_SECRET.encode())
+    return Config.PROFILE_SAMPLE_RATE > 0 and random.random() < Config.PROFILE_SAMPLE_RATE
+
+@app.before_request
+def start_profile():
+    if request.endpoint and not request.path.startswith("/api/admin/profile") and _wants_profile():
+        profiler.begin(request.endpoint)
+        g.profiled = True
+
+@app.after_request
+def mark_profiled(resp):
+    if g.get("profiled"):
+        resp.headers["X-Profiled"] = request.endpoint
+    return resp
+
+@app.teardown_request
+def stop_profile(exc=None):
+    if g.pop("profiled", False):
+        profiler.end()
+
 # ---- Security headers on every API response ----
 @app.after_request
 def secure_headers(resp):
+    resp.headers['X-Request-ID'] = request_id_var.get()
     resp.headers['X-Content-Type-Options'] = 'nosniff'
     resp.headers['X-Frame-Options'] = 'DENY'
     resp.headers['Referrer-Policy'] = 'strict-origin-when-cross-origin'
@@ -133,6 +334,24 @@ def secure_headers(resp):
     resp.headers['Strict-Transport-Security'] = 'max-age=63072000; includeSubDomains; preload'
     return resp
 
+# ---- Compression + conditional GET (per endpoint; streamed responses are skipped) ----
+response_optimizer = ResponseOptimizer(
+    policies={
+        "me": {"etag": True},
+        "api_stats": {"etag": True},
+        "admin_counts": {"etag": True},
+        "admin_usage": {"etag": True},
+        "api_ready": {"compress": False},
+        "api_ping": {"compress": False},
+        "api_status": {"compress": False},
+    },
+    min_bytes=Config.COMPRESSION_MIN_BYTES,
+)
+
+@app.after_request
+def optimize_response(resp):
+    return response_optimizer.process(request, resp)
+
 # ---- Simple rate limiter for lead endpoints ----
 _BUCKET = defaultdict(list)
 def _too_many(ip, limit=30, window=60):
@@ -145,22 +364,38 @@ def _too_many(ip, limit=30, window=60):
     q.append(now)
     return False
 
+def _client_ip() -> str:
+    return (
+        request.headers.get("cf-connecting-ip")
+        or (request.headers.get("x-forwarded-for") or "").split(",")[0].strip()
+        or request.remote_addr
+        or "anon"
+    )
+
 @app.before_request
 def throttle():
     if request.path in ("/api/lead", "/api/lead-min"):
-        ip = (
-            request.headers.get("cf-connecting-ip")
-            or (request.headers.get("x-forwarded-for") or "").split(",")[0].strip()
-            or request.remote_addr
-            or "anon"
-        )
-        if _too_many(ip):
+        if _too_many(_client_ip()):
             return jsonify(error="rate limited"), 429
 
+@app.before_request
+def admit_payments():
+    if request.path in PAYMENT_PATHS and request.method == "POST":
+        try:
+            payments_pool.acquire("member")
+        except Overloaded as e:
+            return _overloaded(e)
+        g.payments_slot = True
+
+@app.teardown_request
+def release_payments(exc=None):
+    if g.pop("payments_slot", False):
+        payments_pool.release()
+
 CORS(app, resources={r"/api/*": {
     "origins": [FRONTEND_ORIGIN, re.compile(r"^https://.*\.vercel\.app$"), "http://localhost:3000"],
     "methods": ["GET","POST","OPTIONS"],
-    "allow_headers": ["Authorization","Content-Type"],
+    "allow_headers": ["Authorization","Content-Type","X-Request-Timeout-Ms","X-Request-ID"],
     "supports_credentials": False,
     "max_age": 86400,
 }})
@@ -192,28 +427,33 @@ def debug_providers():
     return jsonify(openai_key_present=bool(OPENAI_API_KEY),
                    groq_key_present=bool(GROQ_API_KEY)), 200
 
+# Pings run the cheap model-list probe instead of a paid completion
 @app.get("/api/debug/ping-openai")
 def ping_openai():
-    try:
-        out = _call_openai([{"role": "user", "content": "Say 'pong'."}])
-        return jsonify(ok=bool(out), reply=(out or "")), 200
-    except Exception as e:
-        return jsonify(ok=False, error=str(e)), 500
+    if not OPENAI_API_KEY:
+        return jsonify(ok=False, error="not_configured"), 200
+    result = health.probe("openai")
+    return jsonify(ok=result["ok"], latency_ms=result["latency_ms"], error=result["error"]), 200
 
 @app.get("/api/debug/ping-groq")
 def ping_groq():
-    try:
-        out = _call_groq([{"role": "user", "content": "Say 'pong'."}])
-        return jsonify(ok=bool(out), reply=(out or "")), 200
-    except Exception as e:
-        return jsonify(ok=False, error=str(e)), 500
+    if not GROQ_API_KEY:
+        return jsonify(ok=False, error="not_configured"), 200
+    result = health.probe("groq")
+    return jsonify(ok=result["ok"], latency_ms=result["latency_ms"], error=result["error"]), 200
+
+# -------- Readiness (cached probe results, no I/O) --------
+@app.get("/api/ready")
+def api_ready():
+    ready, checks = health.snapshot()
+    return jsonify(ready=ready, checks=checks), (200 if ready else 503)
 
 # ================================
 #   AUTH: Email + Password signup
 # ================================
 @app.post("/api/auth/register")
 def auth_register():
-    if not supabase:
+    if not sb.configured:
         return jsonify(error="supabase_not_configured"), 500
 
     data = request.get_json(force=True) or {}
@@ -227,11 +467,11 @@ def auth_register():
         return jsonify(error="weak_password"), 400
 
     try:
-        supabase.auth.admin.create_user({
+        sb.run("auth:create_user", lambda: supabase.auth.admin.create_user({
             "email": email,
             "password": password,
             "email_confirm": True
-        })
+        }))
     except Exception as e:
         msg = str(e).lower()
         if "already" not in msg and "exists" not in msg:
@@ -239,13 +479,13 @@ def auth_register():
             return jsonify(error="create_failed"), 400
 
     try:
-        supabase.table("user_profiles").upsert({
+        sb.upsert("user_profiles", {
             "email": email,
             "name": name,
             "plan": None,
             "is_member": False,
             "stripe_status": None,
-        }).execute()
+        })
     except Exception as e:
         logging.warning("auth_register profile upsert failed: %s", e)
 
@@ -259,19 +499,16 @@ def me():
     email = (request.args.get("email") or "").strip().lower()
     if not email:
         return jsonify(error="email_required"), 400
-    if not supabase:
+    if not sb.configured:
         return jsonify(error="supabase_not_configured"), 500
     try:
-        pr = supabase.table("user_profiles") \
-                     .select("is_member, plan, stripe_status") \
-                     .eq("email", email).limit(1).execute()
-        prow = (getattr(pr, "data", []) or pr.data or [{}])[0] if pr else {}
-
-        sr = supabase.table("subscriptions") \
-                     .select("status, current_period_end") \
-                     .eq("email", email).order("updated_at", desc=True) \
-                     .limit(1).execute()
-        srow = (getattr(sr, "data", []) or sr.data or [{}])[0] if sr else {}
+        # Profile and latest subscription are independent; fetch them concurrently
+        found = sb.select_many({
+            "profile": ("user_profiles", "is_member, plan, stripe_status", {"email": email}),
+            "subscription": ("subscriptions", "status, current_period_end",
+                             {"email": email, "order": "updated_at"}),
+        })
+        prow, srow = found["profile"], found["subscription"]
 
         return jsonify(
             email=email,
@@ -288,9 +525,7 @@ def me():
 #   LEADS
 # ============================================================
 def _sb_upsert(table: str, payload: dict):
-    if not supabase:
-        raise RuntimeError("Supabase client not initialized")
-    return supabase.table(table).upsert(payload).execute()
+    return sb.upsert(table, payload)
 
 @app.post("/api/lead-min")
 def lead_min():
@@ -349,8 +584,8 @@ def maybe_send_printful_order(recipient: dict):
     if not (PRINTFUL_API_KEY and PRINTFUL_TSHIRT_VARIANT_ID and recipient and recipient.get("email")):
         return
     try:
-        req = requests.post(
-            "https://api.printful.com/orders",
+        req = fault_injector.post(
+            "printful", "https://api.printful.com/orders",
             headers={"Authorization": f"Bearer {PRINTFUL_API_KEY}", "Content-Type": "application/json"},
             data=json.dumps({
                 "recipient": recipient,
@@ -374,6 +609,7 @@ def stripe_webhook():
 
     try:
         event = stripe.Webhook.construct_event(payload=payload, sig_header=sig, secret=STRIPE_WEBHOOK_SECRET)
+        event = event.to_dict()  # StripeObject has no .get() in stripe-python 16
     except Exception:
         logger.exception("Stripe signature verify failed")
         return jsonify(error="invalid signature"), 400
@@ -383,6 +619,7 @@ def stripe_webhook():
 
     try:
         if etype == "checkout.session.completed":
+            checkout_cache.evict_session(data.get("id"))
             email = (data.get("customer_details") or {}).get("email") or data.get("customer_email")
             sub_id = data.get("subscription")
             status = None
@@ -390,7 +627,7 @@ def stripe_webhook():
 
             if sub_id:
                 try:
-                    sub_obj = stripe.Subscription.retrieve(sub_id)
+                    sub_obj = _stripe_call(stripe.Subscription.retrieve, sub_id)
                     status = sub_obj.get("status")
                     period_end = sub_obj.get("current_period_end")
                 except Exception:
@@ -398,21 +635,21 @@ def stripe_webhook():
 
             is_member = status in ("active","trialing")
 
-            if supabase and email:
-                supabase.table("user_profiles").upsert({
-                    "email": email,
-                    "is_member": is_member,
-                    "stripe_status": (status or None),
-                    "plan": "elite",
-                }).execute()
-
-                if sub_id:
-                    supabase.table("subscriptions").upsert({
+            if sb.configured and email:
+                sb.upsert_many({
+                    "user_profiles": {
+                        "email": email,
+                        "is_member": is_member,
+                        "stripe_status": (status or None),
+                        "plan": "elite",
+                    },
+                    "subscriptions": {
                         "email": email,
                         "stripe_subscription_id": sub_id,
                         "status": status,
                         "current_period_end": period_end,
-                    }).execute()
+                    } if sub_id else None,
+                })
 
             # ---- Build full recipient from Stripe session and send to Printful ----
             cust = (data.get("customer_details") or {})
@@ -429,6 +666,9 @@ def stripe_webhook():
             }
             maybe_send_printful_order(recipient)
 
+        elif etype == "checkout.session.expired":
+            checkout_cache.evict_session(data.get("id"))
+
         elif etype in ("customer.subscription.updated","customer.subscription.deleted"):
             sub = data
             status = sub.get("status")
@@ -439,25 +679,26 @@ def stripe_webhook():
             try:
                 cust_id = sub.get("customer")
                 if cust_id:
-                    cust = stripe.Customer.retrieve(cust_id)
+                    cust = _stripe_call(stripe.Customer.retrieve, cust_id)
                     email = cust.get("email")
             except Exception:
                 pass
 
-            if supabase and email:
-                supabase.table("user_profiles").upsert({
-                    "email": email,
-                    "is_member": is_member,
-                    "stripe_status": (status or None),
-                    "plan": "elite",
-                }).execute()
-
-                supabase.table("subscriptions").upsert({
-                    "email": email,
-                    "stripe_subscription_id": sub.get("id"),
-                    "status": status,
-                    "current_period_end": period_end,
-                }).execute()
+            if sb.configured and email:
+                sb.upsert_many({
+                    "user_profiles": {
+                        "email": email,
+                        "is_member": is_member,
+                        "stripe_status": (status or None),
+                        "plan": "elite",
+                    },
+                    "subscriptions": {
+                        "email": email,
+                        "stripe_subscription_id": sub.get("id"),
+                        "status": status,
+                        "current_period_end": period_end,
+                    },
+                })
 
     except Exception:
         logger.exception("Webhook handler failed")
@@ -468,6 +709,9 @@ def stripe_webhook():
 # ============================================================
 #   CHECKOUT (create Stripe Checkout Session)
 # ============================================================
+checkout_cache = CheckoutSessionCache(ttl_seconds=Config.CHECKOUT_SESSION_TTL_SECONDS)
+_verified_prices = set()
+
 @app.post("/api/checkout")
 def checkout_route():
     # 1) Parse JSON
@@ -492,12 +736,20 @@ def checkout_route():
     if not PRICE_ID or not PRICE_ID.startswith("price_"):
         return jsonify({"error": "bad_price_id", "message": f"Backend PRICE_ID looks wrong: {repr(PRICE_ID)}"}), 500
 
-    # (optional) sanity check price exists
-    try:
-        _ = stripe.Price.retrieve(PRICE_ID)
-    except Exception as e:
-        logger.exception("Stripe Price.retrieve failed")
-        return jsonify({"error": "bad_price_id", "message": str(e)}), 500
+    # Serve double-clicks / retries from the still-open session
+    cache_key = checkout_cache.key(email, intent, PRICE_ID)
+    url = checkout_cache.get(cache_key)
+    if url:
+        return jsonify({"url": url}), 200
+
+    # (optional) sanity check price exists (once per process)
+    if PRICE_ID not in _verified_prices:
+        try:
+            _ = _stripe_call(stripe.Price.retrieve, PRICE_ID)
+            _verified_prices.add(PRICE_ID)
+        except Exception as e:
+            logger.exception("Stripe Price.retrieve failed")
+            return jsonify({"error": "bad_price_id", "message": str(e)}), 500
 
     # 4) Build Checkout params
     params = {
@@ -522,9 +774,16 @@ def checkout_route():
     if intent == "trial" and STRIPE_TRIAL_DAYS > 0:
         params["subscription_data"] = {"trial_period_days": STRIPE_TRIAL_DAYS}
 
-    # 5) Create session
+    # 5) Create session (one at a time per key; the idempotency key collapses cross-worker duplicates)
     try:
-        session = stripe.checkout.Session.create(**params)
+        with checkout_cache.lock_for(cache_key):
+            url = checkout_cache.get(cache_key)
+            if url:
+                return jsonify({"url": url}), 200
+            session = _stripe_call(
+                stripe.checkout.Session.create, **params,
+                idempotency_key=checkout_cache.idempotency_key(cache_key, params))
+            checkout_cache.put(cache_key, session.id, session.url, getattr(session, "expires_at", None))
         return jsonify({"url": session.url}), 200
     except stripe.error.StripeError as se:
         msg = getattr(se, "user_message", None) or getattr(se, "code", None) or str(se)
@@ -540,19 +799,23 @@ def checkout_route():
 #   AI CHAT ENDPOINT
 # ============================================================
 def _is_member(email: str) -> bool:
-    if not (supabase and email):
+    if not (sb.configured and email):
         return False
     try:
-        r = supabase.table("user_profiles").select("is_member").eq("email", email).limit(1).execute()
-        rows = getattr(r, "data", []) or r.data
-        return bool(rows and rows[0].get("is_member"))
+        return bool(sb.select_one("user_profiles", "is_member", email=email).get("is_member"))
     except Exception as e:
         logger.warning("membership check failed: %s", e)
         return False
 
+DEGRADED_CHAT_REPLY = (
+    "Coach Will is taking longer than usual to respond. "
+    "Please try your question again in a moment."
+)
+
 @app.post("/api/chat")
 def api_chat():
     try:
+        deadline = _new_deadline(request.headers.get("X-Request-Timeout-Ms"))
         data = request.get_json(force=True) or {}
         email = (data.get("email") or "").strip().lower()
         user_msg = (data.get("message") or data.get("prompt") or "").strip()
@@ -562,13 +825,24 @@ def api_chat():
         if email and not _is_member(email):
             return jsonify(error="not_member"), 403
 
-        system = (
-            "You are Coach Will, a concise, upbeat fitness coach. "
-            "Give practical workout, nutrition, and recovery guidance. "
-            "Favor simple, sustainable plans. Keep answers short and actionable."
-        )
-        messages = [{"role": "system", "content": system}, {"role": "user", "content": user_msg}]
-        reply = _llm_chat(messages)
+        messages = build_messages("member_chat", user_msg)
+        route = model_router.classify(user_msg, stage="member_chat")
+        try:
+            queued_at = perf_counter()
+            # email here has already passed the membership check
+            with llm_pool.admit("member" if email else "anon"):
+                reply = _llm_chat(messages, deadline, user_key=email or f"ip:{_client_ip()}", route=route,
+                                  queue_ms=(perf_counter() - queued_at) * 1000)
+        except Overloaded as e:
+            return _overloaded(e)
+        except QuotaExceeded as e:
+            resp = jsonify(error="quota_exceeded", scope=e.scope)
+            resp.status_code = 429
+            resp.headers["Retry-After"] = str(e.retry_after)
+            return resp
+        except DeadlineExceeded:
+            logger.warning("chat degraded: deadline budget exhausted")
+            return jsonify(reply=DEGRADED_CHAT_REPLY, degraded=True), 200
         if not reply:
             raise RuntimeError("empty_model_reply")
         return jsonify(reply=reply), 200
@@ -578,10 +852,334 @@ def api_chat():
         code = "no_model" if str(e) == "no_model_available" else "chat_failed"
         return jsonify(error=code, message=str(e)), 500
 
+# ============================================================
+#   ADMIN EXPORTS  (streamed NDJSON / CSV, optional gzip)
+# ============================================================
+def _is_admin() -> bool:
+    if not ADMIN_API_TOKEN:
+        return False
+    auth = request.headers.get("Authorization", "")
+    token = auth[7:].strip() if auth.startswith("Bearer ") else ""
+    return hmac.compare_digest(token.encode(), ADMIN_API_TOKEN.encode())
+
+def admin_required(view):
+    """Reject the request with 401 unless it carries the admin bearer token"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not _is_admin():
+            return jsonify(error="unauthorized"), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.get("/api/admin/export/<backend>/<table>")
+@admin_required
+def admin_export(backend: str, table: str):
+    fmt = (request.args.get("format") or "ndjson").lower()
+    if fmt not in ("ndjson", "csv"):
+        return jsonify(error="bad_format"), 400
+    use_gzip = (request.args.get("gzip") or "").lower() in ("1", "true", "yes")
+
+    # Resume by passing the id of the last row received as ?cursor=
+    # (sharded users/messages exports use "<shard>:<id>")
+    cursor = request.args.get("cursor")
+
+    try:
+        rows = export_service.iter_rows(
+            backend, table,
+            since=request.args.get("since"),
+            until=request.args.get("until"),
+            after=cursor,
+            source=request.args.get("source"),
+            status=request.args.get("status"),
+            intent=request.args.get("intent"),
+        )
+    except ValueError as e:
+        return jsonify(error="bad_request", message=str(e)), 400
+    except RuntimeError as e:
+        return jsonify(error="not_configured", message=str(e)), 500
+
+    body = export_service.encode_csv(rows) if fmt == "csv" else export_service.encode_ndjson(rows)
+    if use_gzip:
+        body = export_service.gzip_stream(body)
+
+    if use_gzip:
+        mimetype = "application/gzip"
+    else:
+        mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    resp = Response(stream_with_context(body), mimetype=mimetype)
+    filename = f"{backend}-{table}.{fmt}" + (".gz" if use_gzip else "")
+    resp.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    sharded = backend == "local" and db.shards and table in USER_TABLES
+    resp.headers["X-Export-Cursor-Field"] = "shard:id" if sharded else "id"
+    if backend == "local" and table == "messages" and db.archive_path:
+        # Archived messages are stored as compressed blocks without row ids
+        resp.headers["X-Export-Excludes"] = "archived-messages"
+    return resp
+
+@app.get("/api/admin/counts")
+@admin_required
+def admin_counts():
+    tables = ("users", "messages", "leads", "customers", "tshirt_orders", "knowledge_base")
+    return jsonify(shards=len(db.shards), counts={t: db.count_rows(t) for t in tables}), 200
+
+@app.get("/api/admin/admission")
+@admin_required
+def admin_admission():
+    return jsonify(llm=llm_pool.stats(), payments=payments_pool.stats()), 200
+
+@app.get("/api/admin/usage")
+@admin_required
+def admin_usage():
+    day = request.args.get("day")
+    return jsonify(day=day, rows=db.get_usage_rollup(day)), 200
+
+# ============================================================
+#   STATS (served from rollups only; see AnalyticsService)
+# ============================================================
+_STATS_CACHE: dict = {}
+
+@app.get("/api/stats")
+@admin_required
+def api_stats():
+    try:
+        days = max(1, min(int(request.args.get("days") or 30), 366))
+    except ValueError:
+        return jsonify(error="bad_days"), 400
+
+    cached = _STATS_CACHE.get(days)
+    if cached and time() - cached[0] < Config.STATS_CACHE_SECONDS:
+        return jsonify(cached[1]), 200
+
+    daily = {}
+    for row in db.get_daily_stats(days):
+        daily.setdefault(row["metric"], {}).setdefault(row["day"], {})[row["dimension"]] = row["count"]
+    body = {
+        "days": days,
+        "daily": daily,
+        "gauges": db.get_gauges(),
+        "generated_at": datetime.utcnow().isoformat() + "Z",
+    }
+    _STATS_CACHE[days] = (time(), body)
+    return jsonify(body), 200
+
+@app.get("/api/admin/intents")
+@admin_required
+def admin_intents():
+    return jsonify(ai_service.intent_router.stats()), 200
+
+@app.get("/api/admin/supabase")
+@admin_required
+def admin_supabase():
+    return jsonify(sb.stats()), 200
+
+@app.get("/api/admin/prompt-cache")
+@admin_required
+def admin_prompt_cache():
+    return jsonify(prompt_cache_stats.snapshot()), 200
+
+# Stripe -> Supabase membership resync; POST starts a background run, GET shows the last result
+@app.post("/api/admin/reconcile")
+@admin_required
+def admin_reconcile():
+    full = request.args.get("full") in ("1", "true")
+    dry_run = request.args.get("dry_run") in ("1", "true")
+    if not reconciliation_service.run_in_background(full=full, dry_run=dry_run):
+        return jsonify(error="already_running"), 409
+    return jsonify(started=True, full=full, dry_run=dry_run), 202
+
+@app.get("/api/admin/reconcile")
+@admin_required
+def admin_reconcile_status():
+    return jsonify(running=reconciliation_service.running,
+                   last_result=reconciliation_service.last_result), 200
+
+# Runtime fault injection (non-production only); POST {} to clear all rules
+@app.get("/api/admin/faults")
+@admin_required
+def admin_faults():
+    return jsonify(fault_injector.snapshot()), 200
+
+@app.post("/api/admin/faults")
+@admin_required
+def admin_set_faults():
+    try:
+        fault_injector.set_rules(request.get_json(force=True) or {})
+    except PermissionError as e:
+        return jsonify(error="forbidden", message=str(e)), 403
+    except (ValueError, TypeError, AttributeError) as e:
+        return jsonify(error="invalid_rules", message=str(e)), 400
+    return jsonify(fault_injector.snapshot()), 200
+
+# p50/p95 latency and TTFB per provider/model (or ?by=route) from the hourly telemetry rollup
+@app.get("/api/admin/llm-telemetry")
+@admin_required
+def admin_llm_telemetry():
+    try:
+        hours = max(1, min(int(request.args.get("hours") or 24), 24 * 90))
+    except ValueError:
+        return jsonify(error="bad_hours"), 400
+    by = ("route",) if request.args.get("by") == "route" else ("provider", "model")
+    llm_telemetry.flush()
+    return jsonify(llm_telemetry.summary(hours=hours, by=by)), 200
+
+@app.get("/api/admin/model-routes")
+@admin_required
+def admin_model_routes():
+    return jsonify(model_router.stats()), 200
+
+@app.get("/api/admin/checkout-cache")
+@admin_required
+def admin_checkout_cache():
+    return jsonify(checkout_cache.stats()), 200
+
+# Summary as JSON, or ?format=collapsed for flamegraph.pl / speedscope (optionally ?endpoint=api_chat)
+@app.get("/api/admin/profile")
+@admin_required
+def admin_profile():
+    if (request.args.get("format") or "").lower() == "collapsed":
+        endpoint = request.args.get("endpoint") or None
+        filename = f"profile-{endpoint or 'all'}-{datetime.utcnow():%Y%m%dT%H%M%S}.folded"
+        return Response(profiler.collapsed(endpoint), mimetype="text/plain",
+                        headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+    try:
+        top = max(1, min(int(request.args.get("top") or 15), 200))
+    except ValueError:
+        return jsonify(error="bad_top"), 400
+    return jsonify(profiler.summary(top=top)), 200
+
+@app.post("/api/admin/profile/reset")
+@admin_required
+def admin_profile_reset():
+    profiler.reset()
+    return jsonify(ok=True), 200
+
+# ============================================================
+#   BATCH CHAT (admin bulk generation, streamed as NDJSON)
+# ============================================================
+def _batch_llm_chat(messages, attempts=3):
+    # Batch calls share llm_pool with live chat at anon priority, so a bulk job
+    # can never take the member reserve; a shed call waits Retry-After and tries again
+    for attempt in range(attempts):
+        try:
+            with llm_pool.admit("anon"):
+                return _llm_chat(messages, _new_deadline())
+        except Overloaded as e:
+            if attempt == attempts - 1:
+                raise
+            sleep(e.retry_after)
+
+batch_chat = BatchChat(
+    chat=_batch_llm_chat,
+    build_messages=lambda prompt: build_messages("member_chat", prompt),
+    max_workers=Config.BATCH_MAX_CONCURRENCY,
+    requests_per_minute=Config.BATCH_REQUESTS_PER_MINUTE,
+)
+
+@app.post("/api/chat/batch")
+@admin_required
+def api_chat_batch():
+    data = request.get_json(force=True) or {}
+
+    if not isinstance(data, dict):
+        return jsonify(error="bad_request"), 400
+    prompts = data.get("prompts")
+    if prompts is not None and not isinstance(prompts, list):
+        return jsonify(error="bad_prompts", message="prompts must be a list"), 400
+
+    items = []
+    for p in prompts or []:
+        if isinstance(p, str):
+            item = {"prompt": p}
+        elif isinstance(p, dict):
+            item = {"prompt": p.get("prompt"), "topic": p.get("topic")}
+        else:
+            return jsonify(error="bad_prompt", index=len(items)), 400
+        if not isinstance(item["prompt"], str) or not item["prompt"].strip():
+            return jsonify(error="empty_prompt", index=len(items)), 400
+        if item.get("topic") is not None and not isinstance(item["topic"], str):
+            return jsonify(error="bad_topic", index=len(items)), 400
+        items.append(item)
+    if not items:
+        return jsonify(error="prompts_required"), 400
+    if len(items) > Config.BATCH_MAX_PROMPTS:
+        return jsonify(error="too_many_prompts", max=Config.BATCH_MAX_PROMPTS), 400
+
+    try:
+        concurrency = int(data.get("concurrency") or Config.BATCH_MAX_CONCURRENCY)
+    except (TypeError, ValueError):
+        return jsonify(error="bad_concurrency"), 400
+
+    results = batch_chat.run(items, concurrency=concurrency)
+    save = data.get("save_to_knowledge")
+    if save:
+        save = save if isinstance(save, dict) else {}
+        results = save_to_knowledge(db, results,
+                                    topic=save.get("topic") or "batch",
+                                    category=save.get("category") or "general")
+
+    body = (json.dumps(r) + "\n" for r in results)
+    return Response(stream_with_context(body), mimetype="application/x-ndjson")
+
 # ---------------- Services (unchanged) ----------------
-db = Database(Config.DATABASE_PATH)
-ai_service = AIService(db)
-payment_service = PaymentService(db)
+db = Database(
+    Config.DATABASE_PATH,
+    archive_path=Config.ARCHIVE_DATABASE_PATH,
+    context_cache=UserContextCache(
+        max_users=Config.CONTEXT_CACHE_USERS,
+        history_size=Config.CONTEXT_CACHE_HISTORY,
+    ),
+    shard_count=Config.SHARD_COUNT,
+    shard_pool_size=Config.SHARD_POOL_SIZE,
+)
+usage_ledger = UsageLedger(
+    db,
+    daily_token_quota=Config.LLM_DAILY_TOKEN_QUOTA,
+    minute_token_quota=Config.LLM_MINUTE_TOKEN_QUOTA,
+)
+llm_telemetry = LLMTelemetry(
+    db,
+    flush_interval_seconds=Config.LLM_TELEMETRY_FLUSH_SECONDS,
+    retention_days=Config.LLM_TELEMETRY_RETENTION_DAYS,
+)
+llm_telemetry.start()
+ai_service = AIService(db, usage_ledger=usage_ledger, model_router=model_router,
+                       fault_injector=fault_injector, telemetry=llm_telemetry)
+payment_service = PaymentService(db, fault_injector=fault_injector)
+retention_service = RetentionService(
+    db,
+    retention_days=Config.MESSAGE_RETENTION_DAYS,
+    interval_seconds=Config.COMPACTION_INTERVAL_SECONDS,
+    batch_size=Config.ARCHIVE_BATCH_SIZE,
+    block_size=Config.ARCHIVE_BLOCK_MESSAGES,
+    full_vacuum=Config.COMPACTION_FULL_VACUUM,
+)
+retention_service.start()
+export_service = ExportService(db, sb)
+analytics_service = AnalyticsService(db, sb, interval_seconds=Config.ANALYTICS_INTERVAL_SECONDS)
+analytics_service.start()
+
+reconciliation_service = ReconciliationService(
+    db, sb, stripe, interval_seconds=Config.RECONCILE_INTERVAL_SECONDS, fault_injector=fault_injector
+)
+reconciliation_service.start()
+
+# ---------------- Dependency probes ----------------
+def _probe_models(url: str, key: str):
+    r = requests.get(url, headers={"Authorization": f"Bearer {key}"},
+                     timeout=Config.HEALTH_PROBE_TIMEOUT_SECONDS)
+    r.raise_for_status()
+
+health = HealthProber(interval_seconds=Config.HEALTH_PROBE_INTERVAL_SECONDS)
+health.register("sqlite", db.ping, critical=True)
+if OPENAI_API_KEY:
+    health.register("openai", lambda: _probe_models("https://api.openai.com/v1/models", OPENAI_API_KEY))
+if GROQ_API_KEY:
+    health.register("groq", lambda: _probe_models("https://api.groq.com/openai/v1/models", GROQ_API_KEY))
+if sb.configured:
+    health.register("supabase", lambda: sb.select_one("user_profiles", "email"))
+if STRIPE_SECRET_KEY:
+    health.register("stripe", lambda: stripe.Balance.retrieve())
+health.start()
 
 # ---------------- Entrypoint ----------------
 if __name__ == "__main__":
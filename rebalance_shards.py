@@ -0,0 +1,25 @@
+import argparse
+
+from config import Config
+from database import rebalance_shards
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Copy users/messages into a new shard layout (run with the app stopped)."
+    )
+    parser.add_argument("--from", dest="old_count", type=int, default=Config.SHARD_COUNT,
+                        help="current shard count (0 or 1 = unsharded)")
+    parser.add_argument("--to", dest="new_count", type=int, required=True,
+                        help="target shard count (0 or 1 = unsharded)")
+    parser.add_argument("--db", default=Config.DATABASE_PATH)
+    args = parser.parse_args()
+
+    print(f"🔀 Rebalancing {args.db}: {args.old_count} -> {args.new_count} shards...")
+    copied = rebalance_shards(args.db, args.old_count, args.new_count)
+    print(f"✅ Copied {copied['users']} users and {copied['messages']} messages.")
+    print(f"🚀 Set SHARD_COUNT={args.new_count} and restart. Old files were left in place.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,180 @@
+"""
+Strip rogue backticks from Python files before deploy.
+
+Incremental by default: files whose mtime and size match the cache are skipped
+without being opened, the rest are checked on a worker pool, and rewrites are
+atomic (temp file + rename) so an interrupted run never leaves a half-written file.
+
+    python remove_backticks.py                 # clean changed files
+    python remove_backticks.py --dry-run       # report only; exit 1 if anything would change
+    python remove_backticks.py --full          # ignore the cache
+    python remove_backticks.py --exclude dist --exclude "*.egg-info"
+"""
 import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+from fnmatch import fnmatch
+from concurrent.futures import ThreadPoolExecutor
+
+BACKTICK = chr(96)  # spelled out so this file survives its own cleaning
+CACHE_VERSION = 1
+DEFAULT_CACHE = ".backtick_cache.json"
+DEFAULT_EXCLUDES = (
+    ".git", "node_modules", "attached_assets", "__pycache__", ".venv", "venv",
+    ".pythonlibs", ".cache", ".upm", ".pytest_cache", ".mypy_cache", ".ruff_cache",
+    ".tox", ".nox", "dist", "build", "*.egg-info",
+)
+
+
+def iter_py_files(root_dir, excludes):
+    """Yield (path, stat) for .py files, never descending into excluded directories"""
+    stack = [root_dir]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = list(os.scandir(current))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if not any(fnmatch(entry.name, pattern) for pattern in excludes):
+                    stack.append(entry.path)
+            elif entry.name.endswith(".py") and entry.is_file(follow_symlinks=False):
+                yield os.path.normpath(entry.path), entry.stat(follow_symlinks=False)
+
+
+def load_cache(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") == CACHE_VERSION:
+            return data.get("files", {})
+    except (OSError, ValueError):
+        pass
+    return {}
+
+
+def save_cache(path, files):
+    atomic_write(path, json.dumps({"version": CACHE_VERSION, "files": files},
+                                  separators=(",", ":")).encode("utf-8"))
+
 
+def atomic_write(path, data):
+    """Write to a temp file in the same directory, then rename over the original"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
 
-def clean_backticks_from_py_files(root_dir="."):
+
+def check_file(path, cached_hash, dry_run):
+    """Returns (path, sha1 of the clean content or None, backtick count, line numbers)"""
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha1(data).hexdigest()
+    # Touched but unchanged (e.g. checkout/copy reset the mtime): known clean
+    if digest == cached_hash:
+        return path, digest, 0, []
+    marker = BACKTICK.encode()
+    count = data.count(marker)
+    if not count:
+        return path, digest, 0, []
+
+    lines = [i for i, line in enumerate(data.split(b"\n"), 1) if marker in line]
+    if dry_run:
+        return path, None, count, lines
+    cleaned = data.decode("utf-8").replace(BACKTICK, "").encode("utf-8")
+    atomic_write(path, cleaned)
+    return path, hashlib.sha1(cleaned).hexdigest(), count, lines
+
+
+def clean_backticks_from_py_files(root_dir=".", dry_run=False, full=False, jobs=None,
+                                  excludes=DEFAULT_EXCLUDES, cache_path=None):
+    started = time.perf_counter()
     print("🧹 Scanning for rogue backticks in Python files...\n")
-    changed_files = []
+    cache_path = cache_path or os.path.join(root_dir, DEFAULT_CACHE)
+    cache = {} if full else load_cache(cache_path)
 
-    for subdir, _, files in os.walk(root_dir):
-        for file in files:
-            if file.endswith(".py"):
-                file_path = os.path.join(subdir, file)
+    new_cache, to_check, total = {}, [], 0
+    for path, st in iter_py_files(root_dir, excludes):
+        total += 1
+        entry = cache.get(path)
+        if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            new_cache[path] = entry
+        else:
+            to_check.append((path, st, entry[2] if entry else None))
 
-                with open(file_path, "r", encoding="utf-8") as f:
-                    content = f.read()
+    changed_files = []
+    workers = jobs or min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(check_file, path, cached_hash, dry_run) for path, _, cached_hash in to_check]
+        for (path, st, _), future in zip(to_check, futures):
+            try:
+                path, digest, count, lines = future.result()
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"⚠️  Skipped {path}: {e}")
+                continue
+            if count:
+                changed_files.append(path)
+                shown = ", ".join(map(str, lines[:10])) + (" ..." if len(lines) > 10 else "")
+                verb = "Would clean" if dry_run else "✅ Cleaned"
+                print(f"{verb} {count} backtick(s) from: {path} (lines {shown})")
+            if digest:
+                # Re-stat after a rewrite so the next run sees the new mtime/size
+                st = os.stat(path) if count else st
+                new_cache[path] = [st.st_mtime_ns, st.st_size, digest]
 
-                if "`" in content:
-                    cleaned = content.replace("`", "")
-                    with open(file_path, "w", encoding="utf-8") as f:
-                        f.write(cleaned)
-                    changed_files.append(file_path)
-                    print(f"✅ Cleaned backticks from: {file_path}")
+    if not dry_run:
+        save_cache(cache_path, new_cache)
 
+    elapsed = time.perf_counter() - started
+    print(f"\n📊 {total} file(s) found, {total - len(to_check)} unchanged (cached), "
+          f"{len(to_check)} checked with {workers} worker(s) in {elapsed:.2f}s")
     if not changed_files:
         print("🎯 No backticks found. Codebase is clean.")
+    elif dry_run:
+        print(f"\n❗ {len(changed_files)} file(s) contain backticks (dry run, nothing written).")
     else:
-        print(
-            f"\n🚀 Cleaned {len(changed_files)} file(s). You’re good to redeploy."
-        )
+        print(f"\n🚀 Cleaned {len(changed_files)} file(s). You’re good to redeploy.")
+    return changed_files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Strip rogue backticks from Python files.")
+    parser.add_argument("root", nargs="?", default=".")
+    parser.add_argument("--dry-run", action="store_true", help="report only; exit 1 if backticks are found")
+    parser.add_argument("--full", action="store_true", help="ignore the cache and check every file")
+    parser.add_argument("--jobs", type=int, default=None, help="worker threads (default: 4 x CPUs, max 32)")
+    parser.add_argument("--exclude", action="append", default=[],
+                        help="extra directory name/glob to skip (repeatable)")
+    parser.add_argument("--no-default-excludes", action="store_true")
+    parser.add_argument("--cache", default=None, help=f"cache file (default: <root>/{DEFAULT_CACHE})")
+    args = parser.parse_args()
+
+    excludes = tuple(args.exclude) + (() if args.no_default_excludes else DEFAULT_EXCLUDES)
+    changed = clean_backticks_from_py_files(args.root, dry_run=args.dry_run, full=args.full,
+                                            jobs=args.jobs, excludes=excludes, cache_path=args.cache)
+    if args.dry_run and changed:
+        sys.exit(1)
 
 
 # Run the cleaner
 if __name__ == "__main__":
-    clean_backticks_from_py_files()
+    main()
@@ -0,0 +1,148 @@
+"""
+Replay a traffic capture (see TRAFFIC_CAPTURE_PATH) against a local instance.
+
+Run the target with stubbed upstreams (e.g. OPENAI/GROQ/Stripe/Supabase settings
+pointing at stubs, or fault injection configured) so replays never hit production
+services. Stripe webhooks are re-signed when --stripe-secret matches the target's
+STRIPE_WEBHOOK_SECRET.
+
+    python replay_traffic.py capture.ndjson --base http://localhost:8080 --speed 1
+    python replay_traffic.py capture.ndjson --speed 5      # 5x faster than recorded
+    python replay_traffic.py capture.ndjson --speed 0      # as fast as possible
+
+With --faults (and --admin-token) the given fault-injection rules are applied to a
+non-production target for the duration of the replay, e.g. faults.json:
+    {"supabase": {"latency_ms": 5000}, "groq": {"error_rate": 0.3, "error_status": 429}}
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def load_capture(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def stripe_signature(payload, secret):
+    ts = str(int(time.time()))
+    sig = hmac.new(secret.encode(), f"{ts}.".encode() + payload, hashlib.sha256).hexdigest()
+    return f"t={ts},v1={sig}"
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Replayer:
+    def __init__(self, base, stripe_secret=None, timeout=60):
+        self.base = base.rstrip("/")
+        self.stripe_secret = stripe_secret
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def send(self, entry):
+        headers = dict(entry.get("h") or {})
+        payload = json.dumps(entry["b"]).encode() if entry.get("b") is not None else None
+        if payload is not None:
+            headers.setdefault("Content-Type", "application/json")
+        if entry["p"] == "/api/webhooks/stripe" and self.stripe_secret and payload is not None:
+            headers["Stripe-Signature"] = stripe_signature(payload, self.stripe_secret)
+
+        start = time.perf_counter()
+        try:
+            r = self.session.request(entry["m"], self.base + entry["p"], params=entry.get("q"),
+                                     data=payload, headers=headers, timeout=self.timeout)
+            status = r.status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        elapsed = (time.perf_counter() - start) * 1000
+        with self.lock:
+            self.latencies[entry["p"]].append(elapsed)
+            self.statuses[entry["p"]][status] += 1
+
+    def run(self, entries, speed, concurrency):
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            first_ts = None
+            started = time.monotonic()
+            for entry in entries:
+                if speed > 0:
+                    first_ts = first_ts if first_ts is not None else entry["t"]
+                    due = (entry["t"] - first_ts) / speed
+                    delay = due - (time.monotonic() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+                pool.submit(self.send, entry)
+        return time.monotonic() - started
+
+    def report(self, wall_seconds):
+        total = sum(len(v) for v in self.latencies.values())
+        print(f"\n📊 Replayed {total} requests in {wall_seconds:.1f}s "
+              f"({total / wall_seconds if wall_seconds else 0:.1f} req/s)\n")
+        print(f"{'path':<24}{'count':>7}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}  statuses")
+        for path, values in sorted(self.latencies.items()):
+            values.sort()
+            statuses = ", ".join(f"{k}:{v}" for k, v in sorted(self.statuses[path].items(), key=str))
+            print(f"{path:<24}{len(values):>7}"
+                  f"{percentile(values, 50):>9.1f}{percentile(values, 90):>9.1f}"
+                  f"{percentile(values, 99):>9.1f}{values[-1]:>9.1f}  {statuses}")
+
+
+def set_faults(base, token, rules=None):
+    """POST rules to the target's /api/admin/faults (or GET the current state when rules is None)"""
+    url = f"{base.rstrip('/')}/api/admin/faults"
+    headers = {"Authorization": f"Bearer {token}"}
+    if rules is None:
+        r = requests.get(url, headers=headers, timeout=10)
+    else:
+        r = requests.post(url, json=rules, headers=headers, timeout=10)
+    r.raise_for_status()
+    return r.json()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured API traffic and report latency.")
+    parser.add_argument("capture")
+    parser.add_argument("--base", default="http://localhost:8080")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="1 = recorded pacing, N = N times faster, 0 = as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--stripe-secret", default=None)
+    parser.add_argument("--faults", default=None, help="JSON file of fault-injection rules")
+    parser.add_argument("--admin-token", default=None)
+    args = parser.parse_args()
+
+    if args.faults:
+        with open(args.faults, encoding="utf-8") as f:
+            set_faults(args.base, args.admin_token, json.load(f))
+        print(f"💥 Fault injection enabled from {args.faults}")
+
+    replayer = Replayer(args.base, stripe_secret=args.stripe_secret)
+    try:
+        wall = replayer.run(load_capture(args.capture), args.speed, args.concurrency)
+    finally:
+        if args.faults:
+            injected = set_faults(args.base, args.admin_token).get("injected")
+            set_faults(args.base, args.admin_token, {})
+            print(f"💥 Fault injection cleared; injected: {json.dumps(injected)}")
+    replayer.report(wall)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
 #!/bin/bash
 echo "🔧 Running rogue backtick cleaner..."
-python3 remove_backticks.py
\ No newline at end of file
+# Incremental: unchanged files are skipped via .backtick_cache.json; pass --full or --dry-run as needed
+python3 remove_backticks.py "$@"
@@ -0,0 +1,94 @@
+import time
+import threading
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+class Overloaded(RuntimeError):
+    def __init__(self, pool, retry_after):
+        super().__init__(f"{pool} pool saturated")
+        self.pool = pool
+        self.retry_after = retry_after
+
+class AdmissionPool:
+    """
+    Caps concurrent work of one kind. Excess requests wait briefly in a bounded
+    queue and are shed with Overloaded when no slot frees up in time. Members
+    wait longer, are woken first, and member_reserve slots are theirs only.
+    """
+
+    def __init__(self, name, max_inflight, max_queue=0, member_reserve=0,
+                 member_wait_seconds=2.0, anon_wait_seconds=0.5, retry_after_seconds=5):
+        self.name = name
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.member_reserve = min(member_reserve, max_inflight - 1) if max_inflight > 1 else 0
+        self.member_wait_seconds = member_wait_seconds
+        self.anon_wait_seconds = anon_wait_seconds
+        self.retry_after_seconds = retry_after_seconds
+        self._cond = threading.Condition()
+        self._inflight = 0
+        self._waiting = {'member': 0, 'anon': 0}
+        self._stats = {'admitted': 0, 'queued': 0, 'shed': 0}
+
+    def _can_enter(self, priority):
+        if priority == 'member':
+            return self._inflight < self.max_inflight
+        # Anonymous traffic never takes reserved slots or jumps waiting members
+        return (self._waiting['member'] == 0
+                and self._inflight < self.max_inflight - self.member_reserve)
+
+    def acquire(self, priority='anon'):
+        priority = 'member' if priority == 'member' else 'anon'
+        with self._cond:
+            if self._can_enter(priority):
+                return self._enter()
+            if sum(self._waiting.values()) >= self.max_queue:
+                return self._shed(priority)
+
+            self._stats['queued'] += 1
+            self._waiting[priority] += 1
+            wait = self.member_wait_seconds if priority == 'member' else self.anon_wait_seconds
+            deadline = time.monotonic() + wait
+            try:
+                while not self._can_enter(priority):
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        return self._shed(priority)
+                    self._cond.wait(left)
+            finally:
+                self._waiting[priority] -= 1
+            return self._enter()
+
+    def _enter(self):
+        self._inflight += 1
+        self._stats['admitted'] += 1
+
+    def _shed(self, priority):
+        self._stats['shed'] += 1
+        logger.warning("Admission: shedding %s request from %s pool (%d in flight)",
+                       priority, self.name, self._inflight)
+        raise Overloaded(self.name, self.retry_after_seconds)
+
+    def release(self):
+        with self._cond:
+            self._inflight -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, priority='anon'):
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'inflight': self._inflight,
+                'max_inflight': self.max_inflight,
+                'waiting': dict(self._waiting),
+                **self._stats,
+            }
@@ -1,16 +1,31 @@
 
 import os
+import time
 import requests
 import logging
 from datetime import datetime
 from database import Database
+from services.fault_injection import FaultInjector
+from services.intent_router import IntentRouter
+from services.prompt_builder import build_messages, stage_for, prompt_cache_stats
+from services.deadline import Deadline
+from services.usage_ledger import QuotaExceeded
+from services.model_router import ModelRouter
+from services.llm_telemetry import CallTrace
+from config import Config
 
 logger = logging.getLogger(__name__)
 
 class AIService:
-    def __init__(self, db: Database):
+    def __init__(self, db: Database, usage_ledger=None, model_router=None, fault_injector=None,
+                 telemetry=None):
         self.db = db
+        self.telemetry = telemetry
+        self.fault_injector = fault_injector or FaultInjector()
+        self.usage_ledger = usage_ledger
+        self.model_router = model_router or ModelRouter()
         self.groq_api_key = os.getenv("GROQ_API_KEY")
+        self.intent_router = IntentRouter()
         
     def get_user_context(self, user_id):
         """Load user context from database"""
@@ -31,11 +46,12 @@ class AIService:
             'history': messages
         }
     
-    def generate_response(self, user_input, user_id):
+    def generate_response(self, user_input, user_id, deadline=None):
         """Generate AI response with conversation memory"""
         if not self.groq_api_key:
             return "Error: GROQ_API_KEY not configured"
         
+        deadline = deadline or Deadline(Config.LLM_DEADLINE_SECONDS, Config.LLM_MIN_ATTEMPT_SECONDS)
         try:
             # Get user context
             context = self.get_user_context(user_id)
@@ -43,144 +59,124 @@ class AIService:
             # Save user message
             self.db.add_message(user_id, 'user', user_input)
             
+            # Scripted intents are answered from templates without an LLM call
+            intent = self.intent_router.classify(user_input)
+            scripted = self.intent_router.scripted_reply(intent, context)
+            if scripted:
+                self.db.add_message(user_id, 'assistant', scripted)
+                return scripted
+            
             # Count conversation stage
             user_messages = [m for m in context['history'] if m['role'] == 'user']
             message_count = len(user_messages) + 1  # +1 for current message
             
-            # Build conversation messages
+            # Build conversation messages (knowledge goes after the cacheable prefix)
+            relevant_knowledge = self.db.search_knowledge(user_input)
+            knowledge_context = self._format_knowledge(relevant_knowledge) if relevant_knowledge else None
             messages = self._build_conversation_messages(
-                user_input, context, message_count
+                user_input, context, message_count, knowledge_context
             )
             
-            # Add knowledge context
-            relevant_knowledge = self.db.search_knowledge(user_input)
-            if relevant_knowledge:
-                knowledge_context = self._format_knowledge(relevant_knowledge)
-                messages[0]["content"] += f"\n\nRELEVANT KNOWLEDGE:\n{knowledge_context}"
-            
-            # Call Groq API
-            response = requests.post(
-                "https://api.groq.com/openai/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {self.groq_api_key}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "llama3-8b-8192",
-                    "messages": messages,
-                    "temperature": 0.7,
-                    "max_tokens": 500
-                }
+            # This path is Groq-only: use the route's Groq candidates and completion cap
+            route = self.model_router.classify(
+                user_input, stage=stage_for(message_count), history_turns=message_count - 1
             )
+            table = self.model_router.route(route)
+            models = [m for p, m in table['candidates'] if p == 'groq'] or ['llama3-8b-8192']
+            max_tokens = table['max_tokens']
             
-            if response.status_code == 200:
-                reply = response.json()['choices'][0]['message']['content']
-            else:
-                logger.error(f"Groq API error: {response.status_code} - {response.text}")
-                # Provide helpful fallback based on user input
-                subscription_keywords = ['subscribe', 'sign up', 'join', 'purchase', 'buy', 'pay', 'membership', 'what do i do', 'next step', 'how do i', 'ready to']
-                is_subscription_request = any(keyword in user_input.lower() for keyword in subscription_keywords)
-                
-                if is_subscription_request:
-                    reply = f"Great {context['name']}! To become a Willpower Fitness member, simply click the BUY NOW button that says '$225/MONTH + FREE T-SHIRT' on this page. Once you complete your purchase, you'll have 24/7 access to me as your personal AI trainer!"
-                else:
-                    reply = "Sorry, I'm having trouble connecting right now. Please try again!"
+            if self.usage_ledger:
+                self.usage_ledger.check(user_id, messages, max_tokens=max_tokens)
+            
+            reply = self._call_groq(messages, models, max_tokens, deadline, user_id, route)
             
             # Save AI response
             self.db.add_message(user_id, 'assistant', reply)
             
             return reply
             
+        except QuotaExceeded as e:
+            logger.warning(f"Quota exceeded for {user_id}: {e.scope}")
+            return "You've reached your coaching chat limit for now. Please check back a little later!"
+        except requests.exceptions.Timeout:
+            logger.warning("Groq call timed out within deadline budget")
+            return "Sorry, I'm having trouble connecting right now. Please try again!"
         except Exception as e:
             logger.error(f"AI service error: {e}")
             return "Sorry, there was a problem generating a response. Please try again."
     
-    def _build_conversation_messages(self, user_input, context, message_count):
+    def _call_groq(self, messages, models, max_tokens, deadline, user_id, route):
+        """Try the route's Groq models in order within whatever is left of the request budget"""
+        start = time.perf_counter()
+        trace = CallTrace(self.telemetry, route)
+        for index, model in enumerate(models):
+            timeout = deadline.timeout(30)
+            if timeout is None:
+                logger.warning("Groq skipped: deadline budget exhausted")
+                break
+            attempt_start = time.perf_counter()
+            try:
+                response = self.fault_injector.post(
+                    "groq", "https://api.groq.com/openai/v1/chat/completions",
+                    headers={
+                        "Authorization": f"Bearer {self.groq_api_key}",
+                        "Content-Type": "application/json"
+                    },
+                    json={
+                        "model": model,
+                        "messages": messages,
+                        "temperature": 0.7,
+                        "max_tokens": max_tokens
+                    },
+                    timeout=timeout,
+                    stream=True
+                )
+            except requests.exceptions.Timeout:
+                trace.record('groq', model, 'timeout', (time.perf_counter() - attempt_start) * 1000)
+                logger.warning(f"Groq ({model}) timed out within deadline budget")
+                continue
+            except requests.RequestException as e:
+                trace.record('groq', model, 'error', (time.perf_counter() - attempt_start) * 1000)
+                logger.warning(f"Groq ({model}) request failed: {e}")
+                continue
+            ttfb_ms = (time.perf_counter() - attempt_start) * 1000
+            if response.status_code != 200:
+                trace.record('groq', model, f'http_{response.status_code}',
+                             (time.perf_counter() - attempt_start) * 1000, ttfb_ms)
+                logger.error(f"Groq API error ({model}): {response.status_code} - {response.text}")
+                continue
+            try:
+                body = response.json()
+                reply = (body['choices'][0]['message']['content'] or '').strip()
+            except (requests.RequestException, ValueError, KeyError, IndexError, TypeError) as e:
+                trace.record('groq', model, 'error', (time.perf_counter() - attempt_start) * 1000, ttfb_ms)
+                logger.warning(f"Groq ({model}) returned an unreadable response: {e}")
+                continue
+            usage = body.get('usage')
+            trace.record('groq', model, 'ok' if reply else 'empty',
+                         (time.perf_counter() - attempt_start) * 1000, ttfb_ms, usage)
+            if not reply:
+                logger.warning(f"Groq ({model}) returned an empty completion")
+                continue
+            prompt_cache_stats.record('groq', model, usage)
+            if self.usage_ledger:
+                self.usage_ledger.record(user_id, 'groq', model, usage, messages, reply)
+            self.model_router.record(route, (time.perf_counter() - start) * 1000, index)
+            return reply
+        self.model_router.record(route, (time.perf_counter() - start) * 1000, ok=False)
+        return "Sorry, I'm having trouble connecting right now. Please try again!"
+    
+    def _build_conversation_messages(self, user_input, context, message_count, knowledge=None):
         """Build messages array based on conversation stage"""
-        name = context['name']
-        goal = context['goal']
-        
-        # Check if user is asking about subscription/purchase
-        subscription_keywords = ['subscribe', 'sign up', 'join', 'purchase', 'buy', 'pay', 'membership', 'what do i do', 'next step', 'how do i', 'ready to']
-        is_subscription_request = any(keyword in user_input.lower() for keyword in subscription_keywords)
-        
-        if is_subscription_request:
-            return [
-                {"role": "system", "content": f"""You are Will Power from Willpower Fitness. {name} is ready to subscribe!
-
-SUBSCRIPTION RESPONSE FORMAT:
-"Great {name}! I'm excited to have you join the Willpower Fitness family. To become a member and get unlimited access to me 24/7, simply click the BUY NOW button that says '$225/MONTH + FREE T-SHIRT' - it's prominently displayed on this page.
-
-Once you complete your purchase, you'll immediately have:
-- 24/7 access to me for personalized coaching
-- Complete workout programs and nutrition plans
-- Progress tracking and conversation history
-- Your free Willpower Fitness t-shirt shipped to you
-
-Click that bright BUY NOW button to get started right away! I'll be here waiting for you as your personal AI trainer."
-
-NO emojis, asterisks, or special formatting."""}, 
-                {"role": "user", "content": user_input}
-            ]
-        
-        if message_count == 1:
-            # First response
-            return [
-                {"role": "system", "content": f"""You are Will Power from Willpower Fitness. This is your FIRST response to {name}.
-
-FIRST RESPONSE FORMAT:
-Respond naturally to what they said: '{user_input}'. 
-Then transition to: "Your goal is {goal}. It's not just about exercises or a specific workout routine. It's about sustainable lifestyle changes you can stick to long term. I'm not here to give you a magic bullet or quick fix. I'm here to provide tools, guidance, and support to reach your goals.
-
-Here are a few things I'd like you to focus on:
-1. [General focus area 1]
-2. [General focus area 2] 
-3. [General focus area 3]
-4. [General focus area 4]"
-
-NO emojis, asterisks, or special formatting. Keep it professional."""}, 
-                {"role": "user", "content": user_input}
-            ]
-        elif message_count == 2:
-            # Second response - membership pitch
-            return [
-                {"role": "system", "content": f"""You are Will Power from Willpower Fitness. This is your SECOND response to {name}.
-
-YOU MUST USE THIS EXACT FORMAT:
-
-"{name} I hear you and understand. Once you are a Willpowerfitness AI client, you will have access to me 24 hours a day, 7 days a week, 365 and sometimes 366 days a year. I will track and keep all of our conversations and history and track your progress; but for now I would like you to focus on a few of the following:
-
-1. [Focus area 1 for {goal}]
-2. [Focus area 2 for {goal}]  
-3. [Focus area 3 for {goal}]
-4. [Focus area 4 for {goal}]
-
-Remember, these are some examples, but if you like, and we are hoping you see the value in becoming a Willpowerfitness AI client. Access is key. Accountability is the price. Following-through opens the door."
-
-MUST start with "{name} I hear you and understand" and end with "Access is key. Accountability is the price. Following-through opens the door."
-NO emojis, asterisks, or special formatting."""}, 
-                {"role": "user", "content": user_input}
-            ]
-        else:
-            # Third response and beyond - sales protection
-            messages = [
-                {"role": "system", "content": f"""You are Will Power from Willpower Fitness. You're talking to {name} whose goal is {goal}.
-
-CRITICAL SALES PROTECTION:
-- NEVER provide complete workout routines, sets/reps, or detailed exercise programs
-- NEVER provide meal plans, nutrition schedules, or detailed diet advice  
-- NEVER give step-by-step training guidance or progressive programs
-- ALWAYS redirect detailed requests to: "For complete workout programs, nutrition plans, and personalized coaching, you need Willpower Fitness membership at $225/month!"
-
-Be encouraging but protective of valuable content. NO emojis, asterisks, or special formatting."""}
-            ]
-            
-            # Add recent conversation history
-            for msg in context['history'][-10:]:
-                messages.append({"role": msg["role"], "content": msg["content"]})
-            
-            messages.append({"role": "user", "content": user_input})
-            return messages
+        stage = stage_for(message_count)
+        # Only the ongoing stage carries recent conversation history
+        history = context['history'][-10:] if stage == 'ongoing' else None
+        return build_messages(
+            stage, user_input,
+            profile={'name': context['name'], 'goal': context['goal']},
+            history=history,
+            knowledge=knowledge,
+        )
     
     def _format_knowledge(self, knowledge_items):
         """Format knowledge for context"""
@@ -0,0 +1,90 @@
+import time
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+class RateLimiter:
+    """Token bucket shared by batch workers so bulk jobs stay under provider request limits"""
+
+    def __init__(self, requests_per_minute):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = max(1.0, min(requests_per_minute / 6.0, 10.0))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+class BatchChat:
+    """
+    Runs many independent chat completions with bounded concurrency.
+    chat takes a messages list and returns the reply text (e.g. main._llm_chat).
+    """
+
+    def __init__(self, chat, build_messages, max_workers=4, requests_per_minute=120):
+        self.chat = chat
+        self.build_messages = build_messages
+        self.max_workers = max_workers
+        self.limiter = RateLimiter(requests_per_minute)
+
+    def _run_one(self, index, item):
+        self.limiter.acquire()
+        start = time.perf_counter()
+        result = {'index': index, 'prompt': item['prompt']}
+        if item.get('topic'):
+            result['topic'] = item['topic']
+        try:
+            result['reply'] = self.chat(self.build_messages(item['prompt']))
+        except Exception as e:
+            result['error'] = str(e)
+        result['latency_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        return result
+
+    def run(self, items, concurrency=None):
+        """Yield one result dict per item, in completion order"""
+        workers = max(1, min(concurrency or self.max_workers, self.max_workers))
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch-chat")
+        try:
+            futures = [pool.submit(self._run_one, i, item) for i, item in enumerate(items)]
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            # If the client disconnects mid-stream, drop the prompts not yet started
+            pool.shutdown(wait=False, cancel_futures=True)
+
+def save_to_knowledge(db: Database, results, topic='batch', category='general', flush_every=50):
+    """Pass results through unchanged while bulk-inserting successful ones into knowledge_base"""
+    pending = []
+    try:
+        for result in results:
+            if result.get('reply'):
+                pending.append({
+                    'topic': result.get('topic') or topic,
+                    'question': result['prompt'],
+                    'answer': result['reply'],
+                    'category': category,
+                    'source': 'batch',
+                })
+                if len(pending) >= flush_every:
+                    db.add_knowledge_bulk(pending)
+                    pending = []
+            yield result
+    finally:
+        # Also runs when the client disconnects and the generator is closed mid-stream
+        if pending:
+            db.add_knowledge_bulk(pending)
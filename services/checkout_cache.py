@@ -0,0 +1,90 @@
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+class CheckoutSessionCache:
+    """
+    Short-lived cache of open Stripe Checkout Sessions keyed by (email, intent, price).
+    Double-clicks and client retries get the still-open session URL back instead of a
+    new Session; concurrent duplicates wait on a per-key lock for the first create.
+    Entries are evicted on TTL, on the session's own expires_at, or by webhook.
+    """
+
+    def __init__(self, ttl_seconds=600, max_entries=5000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (session_id, url, valid_until)
+        self._by_session = {}
+        self._key_locks = {}
+        self._generations = {}  # bumped on webhook eviction so the next create gets a fresh key
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(email, intent, price_id):
+        return (email.lower(), intent, price_id)
+
+    def idempotency_key(self, key, params):
+        """Stable within one TTL window and specific to the exact params sent to Stripe"""
+        window = int(time.time() // self.ttl_seconds) if self.ttl_seconds > 0 else 0
+        generation = self._generations.get(key, 0)
+        digest = hashlib.sha256(repr((key, sorted(params.items(), key=str), window, generation)).encode()).hexdigest()
+        return f"checkout-{digest[:40]}"
+
+    def lock_for(self, key):
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                if len(self._key_locks) >= self.max_entries:
+                    self._key_locks = {k: l for k, l in self._key_locks.items() if l.locked()}
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[2] > now:
+                self.hits += 1
+                return entry[1]
+            if entry:
+                self._drop(key)
+            self.misses += 1
+            return None
+
+    def put(self, key, session_id, url, expires_at=None):
+        valid_until = time.time() + self.ttl_seconds
+        if expires_at:
+            valid_until = min(valid_until, expires_at - 60)  # never hand out a session about to expire
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (session_id, url, valid_until)
+            self._by_session[session_id] = key
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def evict_session(self, session_id):
+        with self._lock:
+            key = self._by_session.get(session_id)
+            if key is not None:
+                self._drop(key)
+                self._generations[key] = self._generations.get(key, 0) + 1
+                return True
+        return False
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._by_session.pop(entry[0], None)
+            lock = self._key_locks.get(key)
+            if lock is not None and not lock.locked():
+                del self._key_locks[key]
+
+    def stats(self):
+        with self._lock:
+            return {'open_sessions': len(self._entries), 'hits': self.hits, 'misses': self.misses}
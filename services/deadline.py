@@ -0,0 +1,41 @@
+import time
+
+class DeadlineExceeded(RuntimeError):
+    pass
+
+class Deadline:
+    """One end-to-end time budget shared by every upstream attempt in a request"""
+
+    def __init__(self, budget_seconds, min_attempt_seconds=1.0):
+        self.budget_seconds = budget_seconds
+        self.min_attempt_seconds = min_attempt_seconds
+        self._expires_at = time.monotonic() + budget_seconds
+
+    @classmethod
+    def from_header(cls, value, default_seconds, max_seconds=None, min_attempt_seconds=1.0):
+        """Build from an X-Request-Timeout-Ms style header, falling back to the default"""
+        budget = default_seconds
+        try:
+            if value:
+                budget = max(0.0, int(value) / 1000.0)
+        except (TypeError, ValueError):
+            pass
+        if max_seconds is not None:
+            budget = min(budget, max_seconds)
+        return cls(budget, min_attempt_seconds)
+
+    def remaining(self):
+        return max(0.0, self._expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def timeout(self, cap):
+        """
+        Timeout for the next attempt: what is left of the budget, at most cap seconds.
+        Returns None when there is not enough left for a useful attempt.
+        """
+        left = self.remaining()
+        if left < self.min_attempt_seconds:
+            return None
+        return min(cap, left)
@@ -0,0 +1,109 @@
+import csv
+import io
+import json
+import zlib
+import logging
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Local SQLite tables: timestamp column and which optional filters apply.
+# messages covers the hot table only; rows moved to the archive by retention are not exported
+LOCAL_TABLES = {
+    'users': {'time_column': 'created_at', 'filters': ('source',)},
+    'leads': {'time_column': 'created_at', 'filters': ('source', 'status')},
+    'customers': {'time_column': 'created_at', 'filters': ('status',)},
+    'tshirt_orders': {'time_column': 'created_at', 'filters': ('status',)},
+    'messages': {'time_column': 'timestamp', 'filters': ()},
+}
+
+# Supabase tables (keyset-paginated over id)
+SUPABASE_TABLES = {
+    'leads': {'time_column': 'created_at', 'filters': ('source', 'status', 'intent')},
+    'leads_min': {'time_column': 'created_at', 'filters': ('source',)},
+}
+
+class ExportService:
+    def __init__(self, db: Database, sb=None, chunk_size=1000):
+        self.db = db
+        self.sb = sb
+        self.chunk_size = chunk_size
+
+    def iter_rows(self, backend, table, since=None, until=None, after=None, **filters):
+        """Yield rows from a local or Supabase table in id order, resuming after the given cursor"""
+        if backend == 'local':
+            spec = LOCAL_TABLES.get(table)
+            if not spec:
+                raise ValueError(f"unknown table: {table}")
+            return self.db.iter_table(
+                table,
+                time_column=spec['time_column'],
+                since=since, until=until, after_id=self.db.parse_cursor(table, after),
+                filters={k: v for k, v in filters.items() if k in spec['filters'] and v},
+                chunk_size=self.chunk_size,
+            )
+        if backend == 'supabase':
+            spec = SUPABASE_TABLES.get(table)
+            if not spec:
+                raise ValueError(f"unknown table: {table}")
+            if not (self.sb and self.sb.configured):
+                raise RuntimeError("Supabase client not initialized")
+            return self._iter_supabase(
+                table, spec, since, until, int(after) if after not in (None, '') else None,
+                {k: v for k, v in filters.items() if k in spec['filters'] and v},
+            )
+        raise ValueError(f"unknown backend: {backend}")
+
+    def _iter_supabase(self, table, spec, since, until, after, filters):
+        last_id = after
+        while True:
+            q = self.sb.client.table(table).select("*")
+            if last_id is not None:
+                q = q.gt("id", last_id)
+            if since:
+                q = q.gte(spec['time_column'], since)
+            if until:
+                q = q.lt(spec['time_column'], until)
+            for column, value in filters.items():
+                q = q.eq(column, value)
+            r = self.sb.run(f"export:{table}", q.order("id").limit(self.chunk_size).execute)
+            rows = getattr(r, "data", None) or []
+            for row in rows:
+                yield row
+            if len(rows) < self.chunk_size:
+                return
+            last_id = rows[-1].get("id")
+
+    @staticmethod
+    def encode_ndjson(rows):
+        for row in rows:
+            yield json.dumps(row, default=str, separators=(",", ":")) + "\n"
+
+    @staticmethod
+    def encode_csv(rows):
+        buf = io.StringIO()
+        writer = None
+        for row in rows:
+            if writer is None:
+                writer = csv.DictWriter(buf, fieldnames=list(row.keys()), extrasaction="ignore")
+                writer.writeheader()
+            writer.writerow(row)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate(0)
+
+    @staticmethod
+    def gzip_stream(chunks, flush_bytes=64 * 1024):
+        """Gzip a text stream incrementally, emitting compressed blocks as they fill"""
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        pending = 0
+        for chunk in chunks:
+            data = chunk.encode("utf-8")
+            pending += len(data)
+            out = compressor.compress(data)
+            if pending >= flush_bytes:
+                out += compressor.flush(zlib.Z_SYNC_FLUSH)
+                pending = 0
+            if out:
+                yield out
+        yield compressor.flush()
@@ -0,0 +1,134 @@
+import json
+import time
+import random
+import threading
+import logging
+from collections import defaultdict
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+TARGETS = ("openai", "groq", "supabase", "stripe", "printful")
+
+RULE_DEFAULTS = {
+    'latency_ms': 0,       # added before the call
+    'jitter_ms': 0,        # plus uniform(0, jitter_ms)
+    'latency_rate': 1.0,   # share of calls that get the added latency
+    'error_rate': 0.0,     # fail without calling, with error_status
+    'error_status': 503,
+    'timeout_rate': 0.0,   # hang for the caller's timeout (or timeout_ms), then time out
+    'timeout_ms': 5000,
+    'partial_rate': 0.0,   # make the real call, then lose the response
+}
+
+class InjectedFault(Exception):
+    """Stands in for a dependency failure; code mirrors the HTTP status like client errors do"""
+
+    def __init__(self, target, kind, code=None):
+        super().__init__(f"injected {kind} for {target}" + (f" ({code})" if code else ""))
+        self.target = target
+        self.kind = kind
+        self.code = str(code) if code else None
+
+class InjectedTimeout(InjectedFault):
+    pass
+
+def parse_rules(spec):
+    """{"groq": {"error_rate": 0.3, "error_status": 429}, ...} -> validated rules"""
+    raw = json.loads(spec) if isinstance(spec, str) else (spec or {})
+    rules = {}
+    for target, rule in raw.items():
+        if target not in TARGETS:
+            raise ValueError(f"unknown fault target: {target}")
+        unknown = set(rule) - set(RULE_DEFAULTS)
+        if unknown:
+            raise ValueError(f"unknown fault settings for {target}: {sorted(unknown)}")
+        rules[target] = {**RULE_DEFAULTS, **rule}
+    return rules
+
+class FaultInjector:
+    """
+    Config-driven latency/error/timeout/partial-failure injection for outbound calls.
+    Disabled (a single dict lookup per call) unless rules are set, and rules can only
+    be set when allowed is true, which main.py ties to a non-production APP_ENV.
+    """
+
+    def __init__(self, allowed=False, rules=None):
+        self.allowed = allowed
+        self._rules = {}
+        self._counts = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+        if rules:
+            self.set_rules(rules)
+
+    def set_rules(self, rules):
+        if not self.allowed:
+            raise PermissionError("fault injection is disabled in this environment")
+        rules = parse_rules(rules)
+        with self._lock:
+            self._rules = rules
+            self._counts.clear()
+        if rules:
+            logger.warning(f"Fault injection active for: {', '.join(sorted(rules))}")
+        return rules
+
+    def snapshot(self):
+        with self._lock:
+            return {'allowed': self.allowed, 'rules': dict(self._rules),
+                    'injected': {t: dict(c) for t, c in self._counts.items()}}
+
+    def _plan(self, target):
+        """Sleep any injected latency, then return None / 'timeout' / 'error' / 'partial'"""
+        rule = self._rules.get(target)
+        if not rule:
+            return None, None
+        if rule['latency_ms'] or rule['jitter_ms']:
+            if random.random() < rule['latency_rate']:
+                self._count(target, 'latency')
+                time.sleep((rule['latency_ms'] + random.uniform(0, rule['jitter_ms'])) / 1000.0)
+        r = random.random()
+        for kind in ('timeout', 'error', 'partial'):
+            r -= rule[f'{kind}_rate']
+            if r < 0:
+                self._count(target, kind)
+                return kind, rule
+        return None, rule
+
+    def _count(self, target, kind):
+        with self._lock:
+            self._counts[target][kind] += 1
+
+    def call(self, target, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) under the target's rule, raising InjectedFault/InjectedTimeout"""
+        kind, rule = self._plan(target)
+        if kind == 'timeout':
+            time.sleep(rule['timeout_ms'] / 1000.0)
+            raise InjectedTimeout(target, kind)
+        if kind == 'error':
+            raise InjectedFault(target, kind, rule['error_status'])
+        result = fn(*args, **kwargs)
+        if kind == 'partial':
+            raise InjectedFault(target, kind)
+        return result
+
+    def post(self, target, url, **kwargs):
+        """requests.post with faults expressed as real requests outcomes"""
+        kind, rule = self._plan(target)
+        if kind == 'timeout':
+            timeout = kwargs.get('timeout')
+            time.sleep(timeout if isinstance(timeout, (int, float)) else rule['timeout_ms'] / 1000.0)
+            raise requests.exceptions.Timeout(f"injected timeout for {target}")
+        if kind == 'error':
+            resp = requests.Response()
+            resp.status_code = rule['error_status']
+            resp.url = url
+            resp._content = json.dumps({"error": {"message": f"injected {rule['error_status']}",
+                                                  "type": "injected_fault"}}).encode()
+            resp.headers["Content-Type"] = "application/json"
+            resp.headers["Retry-After"] = "1"
+            return resp
+        resp = requests.post(url, **kwargs)
+        if kind == 'partial':
+            raise requests.exceptions.ConnectionError(f"injected lost response for {target}")
+        return resp
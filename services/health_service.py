@@ -0,0 +1,80 @@
+import time
+import threading
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+class HealthProber:
+    """
+    Runs cheap dependency checks on a background thread and caches the results,
+    so readiness probes and the LLM fallback order read memory instead of the network.
+    """
+
+    def __init__(self, interval_seconds=30):
+        self.interval_seconds = interval_seconds
+        self._checks = {}
+        self._results = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def register(self, name, check, critical=False):
+        """check() should raise (or return False) when the dependency is unhealthy"""
+        self._checks[name] = (check, critical)
+
+    def probe(self, name):
+        check, critical = self._checks[name]
+        start = time.perf_counter()
+        error = None
+        try:
+            ok = check() is not False
+        except Exception as e:
+            ok, error = False, str(e)[:200]
+        result = {
+            'ok': ok,
+            'critical': critical,
+            'latency_ms': round((time.perf_counter() - start) * 1000, 1),
+            'checked_at': datetime.utcnow().isoformat() + 'Z',
+            'error': error,
+            '_checked_mono': time.monotonic(),
+        }
+        with self._lock:
+            previous = self._results.get(name)
+            self._results[name] = result
+        if previous and previous['ok'] != ok:
+            logger.warning("Health: %s is now %s", name, "up" if ok else f"down ({error})")
+        return result
+
+    def probe_all(self):
+        for name in list(self._checks):
+            self.probe(name)
+
+    def is_down(self, name):
+        """True only for a fresh failed probe; unknown or stale state counts as up"""
+        with self._lock:
+            result = self._results.get(name)
+        if not result or result['ok']:
+            return False
+        return time.monotonic() - result['_checked_mono'] < 3 * self.interval_seconds
+
+    def snapshot(self):
+        with self._lock:
+            results = {name: {k: v for k, v in r.items() if not k.startswith('_')}
+                       for name, r in self._results.items()}
+        ready = bool(results) and all(r['ok'] for r in results.values() if r['critical'])
+        return ready, results
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._loop, name="health-prober", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        self.probe_all()
+        while not self._stop.wait(self.interval_seconds):
+            self.probe_all()
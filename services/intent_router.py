@@ -0,0 +1,91 @@
+import re
+import threading
+import logging
+from collections import Counter
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Checked in priority order; the first intent with any match wins.
+# Scripted intents skip the LLM, so pricing/contact use phrases that only fit questions
+# about us ("contact lenses" or "price of protein powder" must still reach the coach).
+INTENT_KEYWORDS = {
+    'subscribe': ['subscribe', 'sign up', 'join', 'purchase', 'buy', 'pay', 'membership',
+                  'what do i do', 'next step', 'how do i', 'ready to'],
+    'pricing': ['membership price', 'membership pricing', 'membership cost', 'subscription price',
+                'subscription cost', 'price of membership', 'price of the membership',
+                'cost of membership', 'cost of the membership', 'your price', 'your prices',
+                'your pricing', 'how much is it', 'how much does it cost', 'monthly fee'],
+    'contact': ['contact you', 'contact the team', 'contact support', 'contact someone',
+                'contact a human', 'contact info', 'contact information', 'contact details',
+                'your phone number', 'email you', 'call you', 'reach you', 'talk to a human',
+                'talk to a person', 'speak to someone'],
+}
+
+SCRIPTED_RESPONSES = {
+    'subscribe': (
+        "Great {name}! I'm excited to have you join the Willpower Fitness family. To become a member "
+        "and get unlimited access to me 24/7, simply click the BUY NOW button that says "
+        "'${price}/MONTH + FREE T-SHIRT' - it's prominently displayed on this page.\n\n"
+        "Once you complete your purchase, you'll immediately have:\n"
+        "- 24/7 access to me for personalized coaching\n"
+        "- Complete workout programs and nutrition plans\n"
+        "- Progress tracking and conversation history\n"
+        "- Your free Willpower Fitness t-shirt shipped to you\n\n"
+        "Click that bright BUY NOW button to get started right away! I'll be here waiting for you "
+        "as your personal AI trainer."
+    ),
+    'pricing': (
+        "Good question {name}. Willpower Fitness membership is ${price}/month and includes a free "
+        "Willpower Fitness t-shirt. That gets you 24/7 access to me for personalized coaching, complete "
+        "workout programs and nutrition plans, and progress tracking. When you're ready, click the "
+        "BUY NOW button on this page."
+    ),
+    'contact': (
+        "Thanks {name}. The fastest way to reach the Willpower Fitness team is the contact form on this "
+        "page - leave your email and a short message and we'll get back to you. I'm also right here "
+        "if you have fitness questions."
+    ),
+}
+
+class IntentRouter:
+    def __init__(self, intent_keywords=None, responses=None):
+        self.intent_keywords = intent_keywords or INTENT_KEYWORDS
+        self.responses = responses or SCRIPTED_RESPONSES
+        self._priority = list(self.intent_keywords)
+        # One alternation for every keyword; the named group tells us which intent matched.
+        # Word boundaries keep 'join' from matching 'joint' and 'pay' from matching 'payload'.
+        self._pattern = re.compile(r'\b(?:' + '|'.join(
+            f"(?P<{intent}>{'|'.join(re.escape(k) for k in keywords)})"
+            for intent, keywords in self.intent_keywords.items()
+        ) + r')\b', re.IGNORECASE)
+        self._hits = Counter()
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def classify(self, text):
+        """Return the highest-priority intent found in text, or None"""
+        found = {m.lastgroup for m in self._pattern.finditer(text or '')}
+        intent = next((i for i in self._priority if i in found), None)
+        with self._lock:
+            self._total += 1
+            self._hits[intent or 'none'] += 1
+        return intent
+
+    def scripted_reply(self, intent, context):
+        """Render the canned response for a scripted intent, or None for LLM intents"""
+        template = self.responses.get(intent)
+        if not template:
+            return None
+        return template.format(name=context.get('name') or 'Friend', price=Config.MEMBERSHIP_PRICE)
+
+    def stats(self):
+        with self._lock:
+            total = self._total
+            return {
+                'total': total,
+                'intents': {
+                    intent: {'hits': hits, 'rate': round(hits / total, 4) if total else 0.0}
+                    for intent, hits in self._hits.items()
+                },
+            }
@@ -0,0 +1,193 @@
+import json
+import atexit
+import bisect
+import threading
+import logging
+from collections import deque, defaultdict
+from datetime import datetime, timedelta
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (ms) of the histogram buckets kept in the hourly rollup; the last bucket is open-ended
+LATENCY_BUCKETS_MS = (50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000,
+                      7500, 10000, 15000, 20000, 30000, 45000, 60000)
+
+def _histogram(values):
+    hist = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    for v in values:
+        hist[bisect.bisect_left(LATENCY_BUCKETS_MS, v)] += 1
+    return hist
+
+def hist_percentile(hist, pct):
+    """Percentile from bucket counts, interpolated linearly inside the bucket"""
+    total = sum(hist)
+    if not total:
+        return None
+    target = total * pct / 100.0
+    seen = 0
+    for i, count in enumerate(hist):
+        if count and seen + count >= target:
+            low = LATENCY_BUCKETS_MS[i - 1] if i else 0
+            high = LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else LATENCY_BUCKETS_MS[-1] * 2
+            return round(low + (high - low) * (target - seen) / count, 1)
+        seen += count
+    return None
+
+def _add(a, b):
+    n = max(len(a), len(b))
+    return [(a[i] if i < len(a) else 0) + (b[i] if i < len(b) else 0) for i in range(n)]
+
+class CallTrace:
+    """Attempts made for one logical LLM request; every attempt after the first is a fallback"""
+
+    def __init__(self, telemetry, route=None, queue_ms=0.0):
+        self.telemetry = telemetry
+        self.route = route
+        self.queue_ms = queue_ms
+        self.attempts = 0
+
+    def record(self, provider, model, status, total_ms, ttfb_ms=None, usage=None):
+        if self.telemetry:
+            self.telemetry.record(provider, model, status, total_ms, ttfb_ms, usage,
+                                  route=self.route, fallback=self.attempts > 0,
+                                  queue_ms=self.queue_ms if self.attempts == 0 else 0.0)
+        self.attempts += 1
+
+class LLMTelemetry:
+    """
+    Per-attempt LLM telemetry. record() only appends to an in-memory buffer; a background
+    thread bulk-inserts the buffer into llm_calls, folds new rows into hourly rollups
+    with latency histograms, and prunes raw rows past retention. summary() reads rollups.
+    """
+
+    def __init__(self, db: Database, flush_interval_seconds=10, retention_days=7, max_buffer=10000):
+        self.db = db
+        self.flush_interval_seconds = flush_interval_seconds
+        self.retention_days = retention_days
+        self._buffer = deque(maxlen=max_buffer)
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def trace(self, route=None, queue_ms=0.0):
+        return CallTrace(self, route, queue_ms)
+
+    def record(self, provider, model, status, total_ms, ttfb_ms=None, usage=None,
+               route=None, fallback=False, queue_ms=0.0):
+        usage = usage or {}
+        self._buffer.append({
+            'created_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+            'provider': provider,
+            'model': model,
+            'route': route,
+            'status': status,
+            'fallback': int(bool(fallback)),
+            'queue_ms': round(queue_ms or 0.0, 1),
+            'ttfb_ms': round(ttfb_ms, 1) if ttfb_ms is not None else None,
+            'total_ms': round(total_ms, 1),
+            'prompt_tokens': usage.get('prompt_tokens') or 0,
+            'completion_tokens': usage.get('completion_tokens') or 0,
+            'cached_tokens': (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0,
+        })
+
+    def flush(self):
+        """Write buffered records, then roll them up; returns rows written"""
+        with self._flush_lock:
+            rows = []
+            while self._buffer:
+                rows.append(self._buffer.popleft())
+            try:
+                self.db.record_llm_calls(rows)
+                self._rollup()
+            except Exception as e:
+                logger.error(f"LLM telemetry flush failed: {e}")
+            return len(rows)
+
+    def _rollup(self):
+        last_id = self.db.get_sync_watermark('llm_calls') or 0
+        while True:
+            rows = self.db.get_llm_calls_after(last_id)
+            if not rows:
+                return
+            groups = defaultdict(list)
+            for row in rows:
+                hour = row['created_at'][:13] + ':00'
+                groups[(hour, row['provider'], row['model'], row['route'] or '')].append(row)
+            increments = {}
+            for key, group in groups.items():
+                increments[key] = {
+                    'calls': len(group),
+                    'errors': sum(1 for r in group if r['status'] != 'ok'),
+                    'timeouts': sum(1 for r in group if r['status'] == 'timeout'),
+                    'fallbacks': sum(r['fallback'] for r in group),
+                    'queue_ms': sum(r['queue_ms'] or 0 for r in group),
+                    'prompt_tokens': sum(r['prompt_tokens'] for r in group),
+                    'completion_tokens': sum(r['completion_tokens'] for r in group),
+                    'cached_tokens': sum(r['cached_tokens'] for r in group),
+                    'latency_hist': _histogram(r['total_ms'] for r in group),
+                    'ttfb_hist': _histogram(r['ttfb_ms'] for r in group if r['ttfb_ms'] is not None),
+                }
+            last_id = rows[-1]['id']
+            self.db.apply_llm_call_rollup(increments, last_id)
+
+    def summary(self, hours=24, by=('provider', 'model')):
+        """p50/p95 latency and TTFB, error/fallback counts and token totals per group"""
+        since = (datetime.utcnow() - timedelta(hours=hours)).strftime('%Y-%m-%d %H:00')
+        groups = {}
+        for row in self.db.get_llm_call_rollups(since):
+            key = tuple(row[k] for k in by)
+            g = groups.setdefault(key, {'calls': 0, 'errors': 0, 'timeouts': 0, 'fallbacks': 0,
+                                        'queue_ms': 0.0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                                        'cached_tokens': 0, 'latency_hist': [], 'ttfb_hist': []})
+            for column in g:
+                if column.endswith('_hist'):
+                    g[column] = _add(g[column], json.loads(row[column] or '[]'))
+                else:
+                    g[column] += row[column] or 0
+        out = []
+        for key, g in groups.items():
+            calls = g['calls']
+            out.append({
+                **dict(zip(by, key)),
+                'calls': calls,
+                'errors': g['errors'],
+                'timeouts': g['timeouts'],
+                'fallbacks': g['fallbacks'],
+                'error_rate': round(g['errors'] / calls, 4) if calls else 0.0,
+                'p50_ms': hist_percentile(g['latency_hist'], 50),
+                'p95_ms': hist_percentile(g['latency_hist'], 95),
+                'ttfb_p50_ms': hist_percentile(g['ttfb_hist'], 50),
+                'ttfb_p95_ms': hist_percentile(g['ttfb_hist'], 95),
+                'avg_queue_ms': round(g['queue_ms'] / calls, 1) if calls else 0.0,
+                'prompt_tokens': g['prompt_tokens'],
+                'completion_tokens': g['completion_tokens'],
+                'cached_tokens': g['cached_tokens'],
+            })
+        out.sort(key=lambda r: r['calls'], reverse=True)
+        return {'hours': hours, 'since': since, 'groups': out}
+
+    def start(self):
+        """Flush, roll up and prune on a background daemon thread"""
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._loop, name="llm-telemetry", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        last_prune = None
+        while not self._stop.wait(self.flush_interval_seconds):
+            self.flush()
+            today = datetime.utcnow().date()
+            if last_prune != today:
+                try:
+                    pruned = self.db.prune_llm_calls(self.retention_days)
+                    if pruned:
+                        logger.info(f"LLM telemetry pruned {pruned} raw rows")
+                except Exception as e:
+                    logger.error(f"LLM telemetry prune failed: {e}")
+                last_prune = today
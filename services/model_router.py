@@ -0,0 +1,118 @@
+import re
+import json
+import threading
+import logging
+from collections import defaultdict, deque
+
+logger = logging.getLogger(__name__)
+
+# route -> ordered (provider, model) candidates and a completion cap.
+# The first candidate is the preferred model; later ones are fallbacks.
+# Larger, pricier models are opt-in, e.g.
+#   MODEL_ROUTES='{"complex": {"candidates": [["openai", "gpt-4o"], ["openai", "gpt-4o-mini"]]}}'
+DEFAULT_ROUTES = {
+    'fast': {
+        'candidates': [["groq", "llama-3.1-8b-instant"], ["openai", "gpt-4o-mini"]],
+        'max_tokens': 300,
+    },
+    'standard': {
+        'candidates': [["openai", "gpt-4o-mini"], ["groq", "llama-3.1-8b-instant"],
+                       ["groq", "llama3-8b-8192"]],
+        'max_tokens': 700,
+    },
+    'complex': {
+        'candidates': [["openai", "gpt-4o-mini"], ["groq", "llama-3.1-70b-versatile"],
+                       ["groq", "llama3-70b-8192"]],
+        'max_tokens': 1200,
+    },
+}
+
+# Requests that ask for structure, reasoning or code go to the complex route
+COMPLEX_PATTERN = re.compile(
+    r'\x60{3}|\btraceback\b|\bdef \w+\(|'  # \x60{3} is a markdown code fence
+    r'\b(?:explain why|step by step|compare|difference between|program for|plan for|'
+    r'periodi[sz]ation|macros?|split|calculate)\b',
+    re.IGNORECASE,
+)
+
+# Templated stages must follow a fixed format that the fast route's completion cap would cut short
+TEMPLATED_STAGES = ('first', 'second')
+
+class ModelRouter:
+    """
+    Picks a route ('fast' / 'standard' / 'complex') per request from prompt length,
+    conversation stage and intent, and keeps per-route latency and fallback stats
+    so the table and thresholds can be tuned from /api/admin/model-routes.
+    """
+
+    def __init__(self, routes=None, fast_max_words=12, complex_min_words=80, window=500):
+        self.routes = routes or DEFAULT_ROUTES
+        self.fast_max_words = fast_max_words
+        self.complex_min_words = complex_min_words
+        self._latencies = defaultdict(lambda: deque(maxlen=window))
+        self._counts = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, spec, **kwargs):
+        """MODEL_ROUTES may override individual routes with the same JSON shape as DEFAULT_ROUTES"""
+        routes = {k: dict(v) for k, v in DEFAULT_ROUTES.items()}
+        if spec:
+            try:
+                for name, route in json.loads(spec).items():
+                    routes[name] = {**routes.get(name, {}), **route}
+            except (ValueError, AttributeError) as e:
+                logger.error(f"Ignoring invalid MODEL_ROUTES: {e}")
+        return cls(routes, **kwargs)
+
+    def classify(self, text, stage=None, intent=None, history_turns=0):
+        text = text or ''
+        words = len(text.split())
+        if COMPLEX_PATTERN.search(text) or words >= self.complex_min_words or text.count('\n') >= 4:
+            route = 'complex'
+        elif stage in TEMPLATED_STAGES:
+            route = 'standard'
+        elif intent or (words <= self.fast_max_words and history_turns < 20):
+            route = 'fast'
+        else:
+            route = 'standard'
+        return route if route in self.routes else 'standard'
+
+    def classify_messages(self, messages, stage=None, intent=None):
+        """Classify from the latest user message of an assembled prompt"""
+        user_turns = [m for m in messages if m.get('role') == 'user']
+        text = user_turns[-1].get('content') if user_turns else ''
+        return self.classify(text, stage, intent, history_turns=len(user_turns) - 1)
+
+    def route(self, name):
+        return self.routes.get(name) or self.routes['standard']
+
+    def record(self, route, latency_ms, candidate_index=0, ok=True):
+        """candidate_index > 0 means a fallback model answered"""
+        with self._lock:
+            counts = self._counts[route]
+            counts['requests'] += 1
+            if not ok:
+                counts['failures'] += 1
+                return
+            if candidate_index:
+                counts['fallbacks'] += 1
+            self._latencies[route].append(latency_ms)
+
+    def stats(self):
+        with self._lock:
+            out = {}
+            for name, route in self.routes.items():
+                values = sorted(self._latencies.get(name, ()))
+                counts = dict(self._counts.get(name, {}))
+                out[name] = {
+                    'candidates': route['candidates'],
+                    'max_tokens': route['max_tokens'],
+                    'requests': counts.get('requests', 0),
+                    'fallbacks': counts.get('fallbacks', 0),
+                    'failures': counts.get('failures', 0),
+                    'p50_ms': round(values[len(values) // 2], 1) if values else None,
+                    'p95_ms': round(values[min(len(values) - 1, int(len(values) * 0.95))], 1) if values else None,
+                }
+            return {'fast_max_words': self.fast_max_words,
+                    'complex_min_words': self.complex_min_words, 'routes': out}
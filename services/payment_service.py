@@ -1,16 +1,17 @@
 
 import os
-import requests
 import stripe
 import logging
 from datetime import datetime
 from database import Database
+from services.fault_injection import FaultInjector
 
 logger = logging.getLogger(__name__)
 
 class PaymentService:
-    def __init__(self, db: Database):
+    def __init__(self, db: Database, fault_injector=None):
         self.db = db
+        self.fault_injector = fault_injector or FaultInjector()
         self.stripe_secret_key = os.getenv("Stripe_payment_key")
         self.printful_api_key = os.getenv("PRINTFUL_API_KEY")
         
@@ -127,8 +128,8 @@ class PaymentService:
                 "shipping": "STANDARD"
             }
             
-            response = requests.post(
-                "https://api.printful.com/orders",
+            response = self.fault_injector.post(
+                "printful", "https://api.printful.com/orders",
                 headers={
                     "Authorization": f"Bearer {self.printful_api_key}",
                     "Content-Type": "application/json"
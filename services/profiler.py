@@ -0,0 +1,119 @@
+import os
+import sys
+import time
+import threading
+import logging
+from collections import Counter, defaultdict
+
+logger = logging.getLogger(__name__)
+
+class SamplingProfiler:
+    """
+    Wall-clock sampling profiler for selected requests.
+    begin()/end() mark the current thread as profiled; a single background thread
+    snapshots those threads' stacks every interval_ms and aggregates them per label
+    into collapsed stacks ("label;outer;...;inner count"), the input format of
+    flamegraph.pl / speedscope. The sampler sleeps while nothing is being profiled.
+    """
+
+    def __init__(self, interval_ms=5, max_depth=64, max_stacks=5000):
+        self.interval = interval_ms / 1000.0
+        self.max_depth = max_depth
+        self.max_stacks = max_stacks
+        self._active = {}  # thread ident -> (label, started)
+        self._stacks = defaultdict(Counter)
+        self._requests = Counter()
+        self._wall_ms = Counter()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def begin(self, label):
+        with self._lock:
+            self._active[threading.get_ident()] = (label, time.perf_counter())
+            if not self._thread:
+                self._thread = threading.Thread(target=self._loop, name="sampling-profiler", daemon=True)
+                self._thread.start()
+            self._wake.set()
+
+    def end(self):
+        with self._lock:
+            entry = self._active.pop(threading.get_ident(), None)
+            if entry is not None:
+                label, started = entry
+                self._requests[label] += 1
+                self._wall_ms[label] += (time.perf_counter() - started) * 1000
+            if not self._active:
+                self._wake.clear()
+
+    def _frame_name(self, frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+    def _collapse(self, frame):
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            names.append(self._frame_name(frame))
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _sample(self):
+        with self._lock:
+            active = dict(self._active)
+        frames = sys._current_frames()
+        for ident, (label, _) in active.items():
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            stack = self._collapse(frame)
+            with self._lock:
+                counts = self._stacks[label]
+                if stack not in counts and len(counts) >= self.max_stacks:
+                    stack = "[other]"
+                counts[stack] += 1
+
+    def _loop(self):
+        while True:
+            self._wake.wait()
+            try:
+                self._sample()
+            except Exception as e:
+                logger.warning(f"Profiler sample failed: {e}")
+            time.sleep(self.interval)
+
+    def collapsed(self, label=None):
+        """Collapsed-stack text for one label (or all), one "stack count" per line"""
+        with self._lock:
+            items = [(l, dict(c)) for l, c in self._stacks.items() if label in (None, l)]
+        lines = []
+        for l, counts in sorted(items):
+            for stack, n in sorted(counts.items()):
+                lines.append(f"{l};{stack} {n}")
+        return "\n".join(lines) + ("\n" if lines else "")
+
+    def summary(self, top=15):
+        """Per label: profiled requests, samples, and the leaf frames holding the most samples"""
+        with self._lock:
+            items = [(l, dict(c)) for l, c in self._stacks.items()]
+            requests = dict(self._requests)
+            wall_ms = dict(self._wall_ms)
+        out = {}
+        for label, counts in items:
+            leaves = Counter()
+            for stack, n in counts.items():
+                leaves[stack.rsplit(";", 1)[-1]] += n
+            total = sum(counts.values())
+            out[label] = {
+                'requests': requests.get(label, 0),
+                'samples': total,
+                'wall_ms': round(wall_ms.get(label, 0), 1),
+                'top_frames': [{'frame': f, 'samples': n, 'pct': round(100.0 * n / total, 1)}
+                               for f, n in leaves.most_common(top)],
+            }
+        return {'interval_ms': self.interval * 1000, 'labels': out}
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self._requests.clear()
+            self._wall_ms.clear()
@@ -0,0 +1,121 @@
+import threading
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever any static prefix changes; providers cache on exact byte prefixes,
+# so the version makes cache-busting edits visible in logs and stats.
+PROMPT_VERSION = "2026-10-19.1"
+
+# Static system prompts per conversation stage. These must stay free of per-user
+# values so every request in a stage shares the same cacheable prefix; the
+# client's name, goal, history and retrieved knowledge go in later messages.
+STATIC_PREFIXES = {
+    'first': """You are Will Power from Willpower Fitness. This is your FIRST response to the client described in the CLIENT PROFILE message.
+
+FIRST RESPONSE FORMAT:
+Respond naturally to what they said in their latest message.
+Then transition to: "Your goal is [CLIENT GOAL]. It's not just about exercises or a specific workout routine. It's about sustainable lifestyle changes you can stick to long term. I'm not here to give you a magic bullet or quick fix. I'm here to provide tools, guidance, and support to reach your goals.
+
+Here are a few things I'd like you to focus on:
+1. [General focus area 1]
+2. [General focus area 2]
+3. [General focus area 3]
+4. [General focus area 4]"
+
+NO emojis, asterisks, or special formatting. Keep it professional.""",
+
+    'second': """You are Will Power from Willpower Fitness. This is your SECOND response to the client described in the CLIENT PROFILE message.
+
+YOU MUST USE THIS EXACT FORMAT:
+
+"[CLIENT NAME] I hear you and understand. Once you are a Willpowerfitness AI client, you will have access to me 24 hours a day, 7 days a week, 365 and sometimes 366 days a year. I will track and keep all of our conversations and history and track your progress; but for now I would like you to focus on a few of the following:
+
+1. [Focus area 1 for CLIENT GOAL]
+2. [Focus area 2 for CLIENT GOAL]
+3. [Focus area 3 for CLIENT GOAL]
+4. [Focus area 4 for CLIENT GOAL]
+
+Remember, these are some examples, but if you like, and we are hoping you see the value in becoming a Willpowerfitness AI client. Access is key. Accountability is the price. Following-through opens the door."
+
+MUST start with "[CLIENT NAME] I hear you and understand" and end with "Access is key. Accountability is the price. Following-through opens the door."
+NO emojis, asterisks, or special formatting.""",
+
+    'ongoing': """You are Will Power from Willpower Fitness. You're talking to the client described in the CLIENT PROFILE message.
+
+CRITICAL SALES PROTECTION:
+- NEVER provide complete workout routines, sets/reps, or detailed exercise programs
+- NEVER provide meal plans, nutrition schedules, or detailed diet advice
+- NEVER give step-by-step training guidance or progressive programs
+- ALWAYS redirect detailed requests to: "For complete workout programs, nutrition plans, and personalized coaching, you need Willpower Fitness membership at $225/month!"
+
+Be encouraging but protective of valuable content. NO emojis, asterisks, or special formatting.""",
+
+    'member_chat': (
+        "You are Coach Will, a concise, upbeat fitness coach. "
+        "Give practical workout, nutrition, and recovery guidance. "
+        "Favor simple, sustainable plans. Keep answers short and actionable."
+    ),
+}
+
+def stage_for(message_count):
+    """Map the number of user turns (including the current one) to a prompt stage"""
+    if message_count == 1:
+        return 'first'
+    if message_count == 2:
+        return 'second'
+    return 'ongoing'
+
+def build_messages(stage, user_input, profile=None, history=None, knowledge=None):
+    """
+    Assemble messages as: static prefix -> client profile -> history -> knowledge -> user.
+    Ordering from most to least stable lets the provider reuse the longest prefix.
+    """
+    messages = [{"role": "system", "content": STATIC_PREFIXES[stage]}]
+    if profile:
+        messages.append({"role": "system", "content": (
+            f"CLIENT PROFILE\nCLIENT NAME: {profile.get('name')}\nCLIENT GOAL: {profile.get('goal')}"
+        )})
+    for msg in history or []:
+        messages.append({"role": msg["role"], "content": msg["content"]})
+    if knowledge:
+        messages.append({"role": "system", "content": f"RELEVANT KNOWLEDGE:\n{knowledge}"})
+    messages.append({"role": "user", "content": user_input})
+    return messages
+
+class PromptCacheStats:
+    """Tracks provider-reported cached prompt tokens per provider and model"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = defaultdict(lambda: {'requests': 0, 'prompt_tokens': 0, 'cached_tokens': 0})
+
+    def record(self, provider, model, usage):
+        if not usage:
+            return
+        details = usage.get('prompt_tokens_details') or {}
+        cached = details.get('cached_tokens') or 0
+        with self._lock:
+            entry = self._totals[(provider, model)]
+            entry['requests'] += 1
+            entry['prompt_tokens'] += usage.get('prompt_tokens') or 0
+            entry['cached_tokens'] += cached
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'prompt_version': PROMPT_VERSION,
+                'models': [
+                    {
+                        'provider': provider,
+                        'model': model,
+                        **entry,
+                        'cached_ratio': round(entry['cached_tokens'] / entry['prompt_tokens'], 4)
+                        if entry['prompt_tokens'] else 0.0,
+                    }
+                    for (provider, model), entry in self._totals.items()
+                ],
+            }
+
+prompt_cache_stats = PromptCacheStats()
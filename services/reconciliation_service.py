@@ -0,0 +1,293 @@
+import time
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from database import Database
+from services.fault_injection import FaultInjector
+
+logger = logging.getLogger(__name__)
+
+WATERMARK = 'stripe:subscriptions'
+SUBSCRIPTION_EVENTS = ["customer.subscription.created", "customer.subscription.updated",
+                       "customer.subscription.deleted"]
+EVENT_RETENTION_SECONDS = 29 * 86400  # Stripe keeps events for 30 days
+WATERMARK_OVERLAP_SECONDS = 300       # re-read a little; applying the same state twice is a no-op
+MEMBER_STATUSES = ("active", "trialing")
+
+def _as_dict(obj):
+    """StripeObject is not a dict subclass in current stripe-python; to_dict() is recursive"""
+    return obj.to_dict() if hasattr(obj, "to_dict") else obj
+
+def _period_end(sub):
+    if sub.get("current_period_end"):
+        return sub.get("current_period_end")
+    items = ((sub.get("items") or {}).get("data") or [])
+    return items[0].get("current_period_end") if items else None
+
+class ReconciliationService:
+    """
+    Brings user_profiles/subscriptions in Supabase in line with Stripe.
+    Incremental runs read subscription events created since the stored watermark;
+    full runs (first run, ?full=1, or a watermark older than Stripe's event retention)
+    page through every subscription. Current rows are loaded in bulk, diffed in memory,
+    and only changed rows are written back as batched upserts.
+    """
+
+    def __init__(self, db: Database, sb, stripe_api, interval_seconds=0, page_size=100,
+                 upsert_batch=500, lookup_workers=8, fault_injector=None):
+        self.db = db
+        self.sb = sb
+        self.stripe = stripe_api
+        self.interval_seconds = interval_seconds
+        self.page_size = page_size
+        self.upsert_batch = upsert_batch
+        self.lookup_workers = lookup_workers
+        self.fault_injector = fault_injector or FaultInjector()
+        self.last_result = None
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._run_lock.locked()
+
+    def run_once(self, full=False, dry_run=False):
+        """Reconcile once; returns a stats dict (or None if a run is already in progress)"""
+        if not self._run_lock.acquire(blocking=False):
+            return None
+        try:
+            result = self._run(full, dry_run)
+        except Exception as e:
+            logger.error(f"Stripe reconciliation failed: {e}")
+            result = {'ok': False, 'error': str(e), 'dry_run': dry_run}
+        finally:
+            self._run_lock.release()
+        self.last_result = result
+        return result
+
+    def run_in_background(self, full=False, dry_run=False):
+        if self.running:
+            return False
+        threading.Thread(target=self.run_once, args=(full, dry_run),
+                         name="stripe-reconcile", daemon=True).start()
+        return True
+
+    def _run(self, full, dry_run):
+        if not (self.stripe.api_key and self.sb.configured):
+            raise RuntimeError("Stripe or Supabase not configured")
+        started = time.time()
+        watermark = self.db.get_sync_watermark(WATERMARK)
+        if watermark is None or started - watermark > EVENT_RETENTION_SECONDS:
+            full = True
+
+        subs = self._fetch_all() if full else self._fetch_changed(watermark)
+        fetched_at = time.time()
+
+        current_subs = self._load_subscriptions(subs, full)
+        self._fill_missing_emails(subs, current_subs)
+        if not full:
+            # Sibling subscriptions of the affected members, so one canceled plan
+            # does not demote someone who still has another live one
+            emails = sorted({s['email'] for s in subs.values() if s['email']})
+            current_subs.update(self._select_in("subscriptions", self.SUBSCRIPTION_COLUMNS, "email", emails,
+                                                key_column="stripe_subscription_id"))
+        current_profiles = self._load_profiles(subs, full)
+        profile_rows, sub_rows = self._diff(subs, current_profiles, current_subs)
+
+        if not dry_run:
+            for table, rows in (("subscriptions", sub_rows), ("user_profiles", profile_rows)):
+                for i in range(0, len(rows), self.upsert_batch):
+                    self.sb.upsert(table, rows[i:i + self.upsert_batch])
+            self.db.set_sync_watermark(WATERMARK, int(started) - WATERMARK_OVERLAP_SECONDS)
+
+        elapsed = time.time() - started
+        result = {
+            'ok': True,
+            'mode': 'full' if full else 'incremental',
+            'dry_run': dry_run,
+            'since': None if full else watermark,
+            'subscriptions_scanned': len(subs),
+            'profiles_changed': len(profile_rows),
+            'subscriptions_changed': len(sub_rows),
+            'unresolved_emails': sum(1 for s in subs.values() if not s['email']),
+            'fetch_seconds': round(fetched_at - started, 2),
+            'total_seconds': round(elapsed, 2),
+            'subscriptions_per_second': round(len(subs) / elapsed, 1) if elapsed else None,
+            'finished_at': int(time.time()),
+        }
+        if full:
+            # Reported only: comped/manual members are left alone
+            emails = {s['email'] for s in subs.values() if s['email']}
+            result['members_without_subscription'] = sum(
+                1 for email, p in current_profiles.items() if p.get('is_member') and email not in emails)
+        if dry_run:
+            result['sample_profiles'] = profile_rows[:20]
+            result['sample_subscriptions'] = sub_rows[:20]
+        logger.info(f"Stripe reconciliation ({result['mode']}{', dry run' if dry_run else ''}): "
+                    f"{len(subs)} subscriptions, {len(profile_rows)} profiles and "
+                    f"{len(sub_rows)} subscriptions changed in {elapsed:.1f}s")
+        return result
+
+    # ---- Stripe ----
+    @staticmethod
+    def _normalize(sub, email=None):
+        customer = sub.get("customer")
+        if customer is not None and not isinstance(customer, str):  # expanded Customer
+            email = email or customer.get("email")
+            customer = customer.get("id")
+        return {
+            'id': sub.get("id"),
+            'customer': customer,
+            'email': (email or "").strip().lower() or None,
+            'status': sub.get("status"),
+            'current_period_end': _period_end(sub),
+            'created': sub.get("created") or 0,
+        }
+
+    def _stripe_call(self, fn, *args, **kwargs):
+        return self.fault_injector.call("stripe", fn, *args, **kwargs)
+
+    def _fetch_all(self):
+        pages = self._stripe_call(self.stripe.Subscription.list, status="all", limit=self.page_size,
+                                  expand=["data.customer"])
+        subs = (_as_dict(sub) for sub in pages.auto_paging_iter())
+        return {sub["id"]: self._normalize(sub) for sub in subs}
+
+    def _fetch_changed(self, since):
+        events = self._stripe_call(self.stripe.Event.list, types=SUBSCRIPTION_EVENTS,
+                                   created={"gt": since}, limit=self.page_size)
+        subs = {}
+        for event in events.auto_paging_iter():  # newest first: the first snapshot per id wins
+            sub = (_as_dict(event).get("data") or {}).get("object") or {}
+            if sub.get("id") and sub["id"] not in subs:
+                subs[sub["id"]] = self._normalize(sub)
+        return subs
+
+    def _fill_missing_emails(self, subs, current_subs):
+        missing = {}
+        for sub in subs.values():
+            if not sub['email']:
+                known = current_subs.get(sub['id'])
+                if known and known.get('email'):
+                    sub['email'] = known['email'].lower()
+                elif sub['customer']:
+                    missing.setdefault(sub['customer'], []).append(sub)
+        if not missing:
+            return
+
+        def lookup(customer_id):
+            try:
+                return customer_id, getattr(self._stripe_call(self.stripe.Customer.retrieve, customer_id), "email", None)
+            except Exception as e:
+                logger.warning(f"Reconcile: customer {customer_id} lookup failed: {e}")
+                return customer_id, None
+
+        with ThreadPoolExecutor(max_workers=self.lookup_workers, thread_name_prefix="reconcile") as pool:
+            for customer_id, email in pool.map(lookup, list(missing)):
+                for sub in missing[customer_id]:
+                    sub['email'] = (email or "").strip().lower() or None
+
+    # ---- Supabase ----
+    SUBSCRIPTION_COLUMNS = "stripe_subscription_id, email, status, current_period_end"
+    PROFILE_COLUMNS = "email, is_member, stripe_status"
+
+    def _load_subscriptions(self, subs, full):
+        if full:
+            return self._select_all("subscriptions", self.SUBSCRIPTION_COLUMNS, "stripe_subscription_id")
+        return self._select_in("subscriptions", self.SUBSCRIPTION_COLUMNS, "stripe_subscription_id", list(subs))
+
+    def _load_profiles(self, subs, full):
+        if full:
+            profiles = self._select_all("user_profiles", self.PROFILE_COLUMNS, "email")
+        else:
+            emails = sorted({s['email'] for s in subs.values() if s['email']})
+            profiles = self._select_in("user_profiles", self.PROFILE_COLUMNS, "email", emails)
+        return {k.lower(): v for k, v in profiles.items()}
+
+    def _select_all(self, table, columns, key, chunk_size=1000):
+        """Keyset-page a whole table into {key: row}"""
+        rows, last = {}, None
+        while True:
+            def call():
+                q = self.sb.client.table(table).select(columns)
+                if last is not None:
+                    q = q.gt(key, last)
+                return q.order(key).limit(chunk_size).execute()
+            page = getattr(self.sb.run(f"reconcile:{table}", call), "data", None) or []
+            rows.update((r[key], r) for r in page if r.get(key))
+            if len(page) < chunk_size:
+                return rows
+            last = page[-1][key]
+
+    def _select_in(self, table, columns, column, values, key_column=None, chunk_size=200):
+        """Rows whose column value is one of values, as {key_column: row}"""
+        key = key_column or column
+        rows = {}
+        for i in range(0, len(values), chunk_size):
+            chunk = values[i:i + chunk_size]
+            r = self.sb.run(f"reconcile:{table}",
+                            lambda: self.sb.client.table(table).select(columns).in_(column, chunk).execute())
+            rows.update((row[key], row) for row in (getattr(r, "data", None) or []) if row.get(key))
+        return rows
+
+    # ---- Diff ----
+    @staticmethod
+    def _diff(subs, current_profiles, current_subs):
+        sub_rows = []
+        best = {}
+        for sub in subs.values():
+            if not sub['email']:
+                continue
+            row = {
+                "email": sub['email'],
+                "stripe_subscription_id": sub['id'],
+                "status": sub['status'],
+                "current_period_end": sub['current_period_end'],
+            }
+            have = current_subs.get(sub['id'])
+            if not have or any(have.get(k) != v for k, v in row.items() if k != "email") \
+                    or (have.get("email") or "").lower() != row["email"]:
+                sub_rows.append(row)
+            # One profile per email: a live subscription beats the newest dead one
+            rank = (sub['status'] in MEMBER_STATUSES, sub['created'])
+            if sub['email'] not in best or rank > best[sub['email']][0]:
+                best[sub['email']] = (rank, sub)
+
+        # Stored subscriptions not seen this run still count toward membership
+        for sub_id, have in current_subs.items():
+            email = (have.get("email") or "").lower()
+            if sub_id in subs or email not in best:
+                continue
+            if have.get("status") in MEMBER_STATUSES and not best[email][0][0]:
+                best[email] = ((True, 0), {'status': have.get("status")})
+
+        profile_rows = []
+        for email, (_, sub) in best.items():
+            is_member = sub['status'] in MEMBER_STATUSES
+            have = current_profiles.get(email)
+            if have and bool(have.get("is_member")) == is_member and have.get("stripe_status") == sub['status']:
+                continue
+            profile_rows.append({
+                "email": email,
+                "is_member": is_member,
+                "stripe_status": sub['status'] or None,
+                "plan": "elite",
+            })
+        return profile_rows, sub_rows
+
+    # ---- Scheduling ----
+    def start(self):
+        """Run incremental reconciliation on a background daemon thread (interval 0 = manual only)"""
+        if self._thread or self.interval_seconds <= 0:
+            return
+        self._thread = threading.Thread(target=self._loop, name="stripe-reconcile-loop", daemon=True)
+        self._thread.start()
+        logger.info(f"Stripe reconciliation scheduled every {self.interval_seconds}s")
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval_seconds):
+            self.run_once()
@@ -0,0 +1,64 @@
+import gzip
+import hashlib
+import logging
+
+try:
+    import brotli  # optional; gzip is used when it is not installed
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript")
+
+class ResponseOptimizer:
+    """
+    After-request response tuning, configured per Flask endpoint:
+      etag     - weak ETag on 200 GETs, 304 for a matching If-None-Match
+      compress - gzip/brotli when the client accepts it and the body is large enough
+    """
+
+    def __init__(self, policies=None, default=None, min_bytes=1024, gzip_level=6):
+        self.policies = policies or {}
+        self.default = default or {"etag": False, "compress": True}
+        self.min_bytes = min_bytes
+        self.gzip_level = gzip_level
+
+    def policy_for(self, endpoint):
+        return {**self.default, **self.policies.get(endpoint, {})}
+
+    def process(self, request, resp):
+        if resp.direct_passthrough or resp.is_streamed:
+            return resp
+        policy = self.policy_for(request.endpoint)
+
+        if policy["etag"] and request.method == "GET" and resp.status_code == 200:
+            resp.set_etag(hashlib.sha1(resp.get_data()).hexdigest(), weak=True)
+            resp.headers.setdefault("Cache-Control", "private, no-cache")
+            resp.make_conditional(request)
+            if resp.status_code == 304:
+                return resp
+
+        if policy["compress"] and self._compressible(resp):
+            resp.vary.add("Accept-Encoding")
+            self._compress(request, resp)
+        return resp
+
+    def _compressible(self, resp):
+        return (resp.status_code == 200
+                and "Content-Encoding" not in resp.headers
+                and (resp.mimetype or "").startswith(COMPRESSIBLE_TYPES))
+
+    def _compress(self, request, resp):
+        data = resp.get_data()
+        if len(data) < self.min_bytes:
+            return
+        accepted = request.accept_encodings
+        if brotli and accepted["br"]:
+            body, encoding = brotli.compress(data, quality=5), "br"
+        elif accepted["gzip"]:
+            body, encoding = gzip.compress(data, compresslevel=self.gzip_level), "gzip"
+        else:
+            return
+        resp.set_data(body)
+        resp.headers["Content-Encoding"] = encoding
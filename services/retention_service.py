@@ -0,0 +1,48 @@
+import threading
+import logging
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+class RetentionService:
+    def __init__(self, db: Database, retention_days=30, interval_seconds=6 * 3600,
+                 batch_size=5000, block_size=500, full_vacuum=False):
+        self.db = db
+        self.retention_days = retention_days
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.block_size = block_size
+        self.full_vacuum = full_vacuum
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        """Archive old conversations and shrink the hot database"""
+        try:
+            archived = self.db.archive_messages(self.retention_days, self.batch_size, self.block_size)
+            if archived:
+                self.db.compact(full=self.full_vacuum)
+            return archived
+        except Exception as e:
+            logger.error(f"Message compaction failed: {e}")
+            return 0
+
+    def start(self):
+        """Run compaction on a background daemon thread"""
+        if self._thread or not self.db.archive_path:
+            return
+        self._thread = threading.Thread(
+            target=self._loop, name="message-compaction", daemon=True
+        )
+        self._thread.start()
+        logger.info(
+            f"Message compaction scheduled every {self.interval_seconds}s "
+            f"(retention {self.retention_days} days)"
+        )
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval_seconds):
+            self.run_once()
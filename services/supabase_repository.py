@@ -0,0 +1,134 @@
+import time
+import random
+import threading
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+TRANSIENT_STATUS = {"408", "425", "429", "500", "502", "503", "504"}
+TRANSIENT_ERRORS = ("Timeout", "ConnectError", "ReadError", "WriteError",
+                    "RemoteProtocolError", "PoolTimeout", "ConnectionError")
+
+def create_supabase_client(url, key, timeout=10, pool_size=20):
+    """Create a Supabase client with bounded timeouts and a keep-alive connection pool"""
+    from supabase import create_client
+    try:
+        from supabase import ClientOptions
+        options = ClientOptions(postgrest_client_timeout=timeout)
+        # Newer supabase-py releases accept a shared httpx client; older ones keep their default pool
+        if hasattr(options, "httpx_client"):
+            import httpx
+            options.httpx_client = httpx.Client(
+                timeout=timeout,
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            )
+        return create_client(url, key, options=options)
+    except ImportError:
+        return create_client(url, key)
+
+def _is_transient(exc):
+    code = str(getattr(exc, "code", "") or getattr(exc, "status_code", "") or "")
+    if code in TRANSIENT_STATUS:
+        return True
+    return any(name in type(exc).__name__ for name in TRANSIENT_ERRORS)
+
+def _rows(result):
+    return (getattr(result, "data", None) or []) if result is not None else []
+
+class SupabaseRepository:
+    """Single entry point for Supabase reads/writes: retries, batching and per-call timing"""
+
+    def __init__(self, client, max_retries=2, backoff_seconds=0.2, max_workers=4, fault_injector=None):
+        self.client = client
+        self.fault_injector = fault_injector
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="supabase")
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {"calls": 0, "errors": 0, "retries": 0,
+                                           "total_ms": 0.0, "max_ms": 0.0})
+
+    @property
+    def configured(self):
+        return self.client is not None
+
+    def run(self, op, fn):
+        """Run fn() (which performs one Supabase call) with retry on transient errors"""
+        if not self.client:
+            raise RuntimeError("Supabase client not initialized")
+        attempt = 0
+        start = time.perf_counter()
+        while True:
+            try:
+                result = self.fault_injector.call("supabase", fn) if self.fault_injector else fn()
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_transient(e):
+                    self._record(op, start, error=True, retries=attempt)
+                    raise
+                attempt += 1
+                # Exponential backoff with full jitter
+                time.sleep(random.uniform(0, self.backoff_seconds * (2 ** attempt)))
+                logger.info("Supabase %s retry %d after: %s", op, attempt, e)
+                continue
+            self._record(op, start, retries=attempt)
+            return result
+
+    def _record(self, op, start, error=False, retries=0):
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            s = self._stats[op]
+            s["calls"] += 1
+            s["errors"] += int(error)
+            s["retries"] += retries
+            s["total_ms"] += elapsed_ms
+            s["max_ms"] = max(s["max_ms"], elapsed_ms)
+        logger.debug("Supabase %s took %.1fms", op, elapsed_ms)
+
+    # ---- Reads ----
+    def select_one(self, table, columns, order=None, **eq):
+        """First row matching eq filters (optionally the newest by the order column), or {}"""
+        def call():
+            q = self.client.table(table).select(columns)
+            for column, value in eq.items():
+                q = q.eq(column, value)
+            if order:
+                q = q.order(order, desc=True)
+            return q.limit(1).execute()
+        rows = _rows(self.run(f"select:{table}", call))
+        return rows[0] if rows else {}
+
+    def select_many(self, queries):
+        """Run independent select_one lookups concurrently; queries is {key: (table, columns, kwargs)}"""
+        futures = {
+            key: self._executor.submit(self.select_one, table, columns, **kwargs)
+            for key, (table, columns, kwargs) in queries.items()
+        }
+        return {key: f.result() for key, f in futures.items()}
+
+    # ---- Writes ----
+    def upsert(self, table, rows, on_conflict=None):
+        """Upsert one row or a list of rows in a single request"""
+        rows = rows if isinstance(rows, list) else [rows]
+        if not rows:
+            return []
+        def call():
+            if on_conflict:
+                return self.client.table(table).upsert(rows, on_conflict=on_conflict).execute()
+            return self.client.table(table).upsert(rows).execute()
+        return _rows(self.run(f"upsert:{table}", call))
+
+    def upsert_many(self, writes):
+        """Write several tables concurrently; writes is {table: rows}. Raises the first failure."""
+        futures = [self._executor.submit(self.upsert, table, rows)
+                   for table, rows in writes.items() if rows]
+        return [f.result() for f in futures]
+
+    def stats(self):
+        with self._lock:
+            return {
+                op: {**s, "avg_ms": round(s["total_ms"] / s["calls"], 2) if s["calls"] else 0.0,
+                     "total_ms": round(s["total_ms"], 2), "max_ms": round(s["max_ms"], 2)}
+                for op, s in self._stats.items()
+            }
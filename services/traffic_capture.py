@@ -0,0 +1,123 @@
+import json
+import queue
+import random
+import hashlib
+import threading
+import logging
+from time import time, sleep
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_PATHS = ("/api/chat", "/api/lead", "/api/lead-min", "/api/me", "/api/webhooks/stripe")
+
+# Identity fields are replaced by stable pseudonyms so duplicate/upsert patterns survive
+IDENTITY_KEYS = {"email", "customer_email", "receipt_email", "client_reference_id"}
+# Free-text and personal fields are replaced by same-length filler (length drives LLM cost)
+REDACT_KEYS = {"name", "phone", "password", "message", "prompt", "goal", "constraints", "prefs",
+               "line1", "line2", "city", "postal_code", "state", "address", "address1", "address2",
+               "zip", "schedule", "experience", "headline"}
+
+def _pseudonym(value):
+    digest = hashlib.sha256(str(value).lower().encode("utf-8")).hexdigest()[:12]
+    return f"user-{digest}@example.com"
+
+def sanitize(value, key=None):
+    """Recursively strip personal data from a JSON-like value"""
+    if isinstance(value, dict):
+        return {k: sanitize(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [sanitize(v, key) for v in value]
+    if isinstance(value, str) and key:
+        k = key.lower()
+        if k in IDENTITY_KEYS:
+            return _pseudonym(value)
+        if k in REDACT_KEYS:
+            return "x" * len(value)
+    return value
+
+class TrafficCapture:
+    """
+    Opt-in request recorder. Each captured request becomes one compact JSON line:
+      {"t": epoch, "m": method, "p": path, "q": query, "h": headers, "b": body, "s": status, "d": ms}
+    Lines are written by a background thread so capture adds no file I/O to requests.
+    """
+
+    def __init__(self, path, sample_rate=1.0, paths=CAPTURE_PATHS, max_queue=10000):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.paths = set(paths)
+        # Bounded: if the writer falls behind (or dies), requests drop entries instead of piling up
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self.captured = 0
+        self.dropped = 0
+        self.write_errors = 0
+        self._thread = threading.Thread(target=self._writer, name="traffic-capture", daemon=True)
+        self._thread.start()
+        logger.info(f"Traffic capture enabled -> {path} (sample {sample_rate})")
+
+    def wants(self, path):
+        return path in self.paths and (self.sample_rate >= 1 or random.random() < self.sample_rate)
+
+    def record(self, request, status, duration_ms):
+        raw = request.get_data(cache=True)
+        body = None
+        if raw:
+            try:
+                body = sanitize(json.loads(raw))
+            except ValueError:
+                body = None
+        query = {k: sanitize(v, k) for k, v in request.args.items()}
+        entry = {
+            "t": round(time(), 3),
+            "m": request.method,
+            "p": request.path,
+            "q": query or None,
+            "h": {k: v for k, v in (("Content-Type", request.headers.get("Content-Type")),) if v},
+            "b": body,
+            "s": status,
+            "d": round(duration_ms, 1),
+        }
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+                dropped = self.dropped
+            if dropped == 1 or dropped % 1000 == 0:
+                logger.warning(f"Traffic capture queue full; {dropped} entries dropped so far")
+
+    def stats(self):
+        with self._lock:
+            return {'captured': self.captured, 'dropped': self.dropped, 'write_errors': self.write_errors,
+                    'queued': self._queue.qsize(), 'writer_alive': self._thread.is_alive()}
+
+    def _writer(self):
+        # Never exits: a failed write is logged and counted, and the file is reopened
+        while True:
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    while True:
+                        batch = [self._queue.get()]
+                        # Batch whatever else is already queued before flushing
+                        try:
+                            while True:
+                                batch.append(self._queue.get_nowait())
+                        except queue.Empty:
+                            pass
+                        written = 0
+                        for entry in batch:
+                            try:
+                                f.write(json.dumps(entry, separators=(",", ":"), default=str) + "\n")
+                                written += 1
+                            except (TypeError, ValueError) as e:
+                                logger.warning(f"Traffic capture skipped an entry: {e}")
+                        f.flush()
+                        with self._lock:
+                            self.captured += written
+                            self.write_errors += len(batch) - written
+            except Exception as e:
+                with self._lock:
+                    self.write_errors += 1
+                logger.error(f"Traffic capture write failed: {e}")
+                sleep(1)
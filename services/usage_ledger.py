@@ -0,0 +1,122 @@
+import time
+import threading
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+class QuotaExceeded(RuntimeError):
+    def __init__(self, scope, retry_after):
+        super().__init__(f"{scope} token quota exceeded")
+        self.scope = scope
+        self.retry_after = max(1, int(retry_after))
+
+def estimate_tokens(text):
+    """Rough local estimate (~4 characters per token) for providers that omit usage"""
+    return max(1, len(text or '') // 4)
+
+def estimate_prompt_tokens(messages):
+    return sum(estimate_tokens(m.get('content')) + 4 for m in messages)
+
+class UsageLedger:
+    """
+    Per-user token accounting. Every call is appended to the SQLite ledger; quotas
+    are enforced from in-memory counters (a 60 s sliding window and today's total,
+    seeded from the daily rollup on first use) so checks add no database reads.
+    """
+
+    def __init__(self, db: Database, daily_token_quota=0, minute_token_quota=0,
+                 expected_completion_tokens=500):
+        self.db = db
+        self.daily_token_quota = daily_token_quota
+        self.minute_token_quota = minute_token_quota
+        self.expected_completion_tokens = expected_completion_tokens
+        self._lock = threading.Lock()
+        self._minute = {}  # user_key -> deque[(monotonic ts, tokens)], dropped once empty
+        self._daily = {}   # user_key -> (day, tokens), today's entries only
+        self._day = None
+        self._next_sweep = 0.0
+
+    def _today(self):
+        return datetime.utcnow().date().isoformat()
+
+    def _sweep(self, now, day):
+        """Drop idle minute windows and entries from earlier days; caller holds the lock"""
+        if day != self._day:
+            self._day = day
+            self._daily = {k: v for k, v in self._daily.items() if v[0] == day}
+        if now >= self._next_sweep:
+            self._next_sweep = now + 60
+            self._minute = {k: w for k, w in self._minute.items() if w and now - w[-1][0] < 60}
+
+    def _daily_used(self, user_key):
+        """Today's tokens for user_key; a cache miss reads the rollup without holding the lock"""
+        day = self._today()
+        with self._lock:
+            cached = self._daily.get(user_key)
+            if cached and cached[0] == day:
+                return cached[1]
+        used = self.db.get_daily_token_usage(user_key)
+        with self._lock:
+            # A concurrent miss may have filled it first (and record() may have added to it)
+            cached = self._daily.get(user_key)
+            if cached and cached[0] == day:
+                return cached[1]
+            self._daily[user_key] = (day, used)
+        return used
+
+    def _window(self, user_key, now):
+        window = self._minute.get(user_key)
+        if window is None:
+            return ()
+        while window and now - window[0][0] >= 60:
+            window.popleft()
+        if not window:
+            del self._minute[user_key]
+        return window
+
+    def check(self, user_key, messages, max_tokens=None):
+        """Raise QuotaExceeded if this call would push user_key over a quota"""
+        if not user_key or not (self.daily_token_quota or self.minute_token_quota):
+            return
+        projected = estimate_prompt_tokens(messages) + (max_tokens or self.expected_completion_tokens)
+        if self.minute_token_quota:
+            with self._lock:
+                now = time.monotonic()
+                self._sweep(now, self._today())
+                window = self._window(user_key, now)
+                used = sum(tokens for _, tokens in window)
+                if window and used + projected > self.minute_token_quota:
+                    raise QuotaExceeded("minute", 60 - (now - window[0][0]))
+        if self.daily_token_quota:
+            used = self._daily_used(user_key)
+            if used + projected > self.daily_token_quota:
+                tomorrow = datetime.utcnow().date() + timedelta(days=1)
+                midnight = datetime.combine(tomorrow, datetime.min.time())
+                raise QuotaExceeded("daily", (midnight - datetime.utcnow()).total_seconds())
+
+    def record(self, user_key, provider, model, usage, messages=None, reply=None):
+        """Record one completed call, using provider-reported usage when available"""
+        if not user_key:
+            return
+        usage = usage or {}
+        estimated = not usage.get('prompt_tokens')
+        prompt_tokens = usage.get('prompt_tokens') or estimate_prompt_tokens(messages or [])
+        completion_tokens = usage.get('completion_tokens') or estimate_tokens(reply)
+        total = prompt_tokens + completion_tokens
+        with self._lock:
+            now = time.monotonic()
+            day = self._today()
+            self._sweep(now, day)
+            if self.minute_token_quota:
+                self._minute.setdefault(user_key, deque()).append((now, total))
+            cached = self._daily.get(user_key)
+            if cached and cached[0] == day:
+                self._daily[user_key] = (day, cached[1] + total)
+        try:
+            self.db.record_llm_usage(user_key, provider, model, prompt_tokens,
+                                     completion_tokens, estimated)
+        except Exception as e:
+            logger.warning(f"Usage ledger write failed: {e}")
@@ -0,0 +1,22 @@
+import os
+import sys
+import atexit
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Config reads the environment at import time, before any fixture runs
+os.environ.setdefault("GROQ_API_KEY", "test-key")
+
+
+@pytest.fixture(scope="session")
+def main_module(tmp_path_factory):
+    """Import main.py with its relative SQLite/log paths pointed at a scratch directory"""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("app"))
+    import main
+    yield main
+    # The exit-time flush would otherwise run against the repo's own database file
+    main.llm_telemetry.stop()
+    atexit.unregister(main.llm_telemetry.flush)
+    os.chdir(cwd)
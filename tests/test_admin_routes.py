@@ -0,0 +1,13 @@
+import re
+
+
+def test_every_admin_route_requires_the_token(main_module):
+    client = main_module.app.test_client()
+    admin_rules = [rule for rule in main_module.app.url_map.iter_rules()
+                   if rule.rule.startswith("/api/admin") or rule.endpoint == "api_chat_batch"]
+    assert admin_rules
+    for rule in admin_rules:
+        path = re.sub(r"<[^>]+>", "x", rule.rule)
+        method = "GET" if "GET" in rule.methods else "POST"
+        resp = client.open(path, method=method, json={})
+        assert resp.status_code == 401, f"{method} {rule.rule} returned {resp.status_code}"
@@ -0,0 +1,43 @@
+import sqlite3
+
+from database import Database
+
+
+def _seed(db, users=3, per_user=25, timestamp='2000-01-01 00:00:00'):
+    with db.get_connection() as conn:
+        conn.executemany(
+            'INSERT INTO messages (user_id, role, content, timestamp) VALUES (?, ?, ?, ?)',
+            [(f'u{i % users}', 'user', f'm{i}', timestamp) for i in range(users * per_user)],
+        )
+        conn.commit()
+
+
+def test_archive_runs_in_batches_and_caps_block_size(tmp_path):
+    db = Database(str(tmp_path / 'hot.db'), archive_path=str(tmp_path / 'cold.db'))
+    _seed(db)
+    db.add_message('u0', 'user', 'recent')
+
+    assert db.archive_messages(30, batch_size=20, block_size=10) == 75
+    assert db.count_rows('messages') == 1
+
+    with db.get_archive_connection() as conn:
+        counts = [row[0] for row in conn.execute('SELECT message_count FROM message_archive')]
+    assert max(counts) <= 10
+    assert sum(counts) == 75
+
+    history = db.get_user_messages('u0', limit=100)
+    assert len(history) == 26
+    assert history[-1]['content'] == 'recent'
+    assert [m['content'] for m in history[:3]] == ['m0', 'm3', 'm6']
+
+
+def test_compact_is_incremental_unless_full(tmp_path):
+    path = str(tmp_path / 'hot.db')
+    db = Database(path, archive_path=str(tmp_path / 'cold.db'))
+    with sqlite3.connect(path) as conn:
+        assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+    _seed(db, per_user=500)
+    db.archive_messages(30)
+    db.compact()
+    with sqlite3.connect(path) as conn:
+        assert conn.execute('PRAGMA freelist_count').fetchone()[0] == 0
@@ -0,0 +1,26 @@
+import threading
+
+from database import Database, UserContextCache
+
+
+def test_miss_fill_does_not_drop_a_concurrent_message(tmp_path):
+    db = Database(str(tmp_path / 'hot.db'), context_cache=UserContextCache(history_size=10))
+    db.add_message('u1', 'user', 'first')
+
+    read = db._read_user_messages
+    writer = {}
+
+    def slow_read(user_id, fetch):
+        rows = read(user_id, fetch)
+        # A reply lands while the miss path still holds rows from before it
+        writer['thread'] = threading.Thread(target=db.add_message, args=('u1', 'assistant', 'second'))
+        writer['thread'].start()
+        writer['thread'].join(0.2)
+        return rows
+
+    db._read_user_messages = slow_read
+    assert [m['content'] for m in db.get_user_messages('u1')] == ['first']
+    writer['thread'].join()
+    db._read_user_messages = read
+
+    assert [m['content'] for m in db.get_user_messages('u1')] == ['first', 'second']
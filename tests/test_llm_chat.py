@@ -0,0 +1,28 @@
+def test_only_configured_provider_is_used_even_when_probed_down(main_module, monkeypatch):
+    calls = []
+
+    def fake_groq(messages, deadline=None, user_key=None, models=None, max_tokens=None, trace=None):
+        calls.append(models)
+        return "ok"
+
+    monkeypatch.setattr(main_module, "OPENAI_API_KEY", None)
+    monkeypatch.setattr(main_module, "GROQ_API_KEY", "test-key")
+    monkeypatch.setattr(main_module.health, "is_down", lambda name: name == "groq")
+    monkeypatch.setattr(main_module, "_call_groq", fake_groq)
+
+    reply = main_module._llm_chat([{"role": "user", "content": "hi"}], route="standard")
+
+    assert reply == "ok"
+    assert calls
+
+
+def test_down_provider_is_skipped_when_another_is_configured(main_module, monkeypatch):
+    calls = []
+    monkeypatch.setattr(main_module, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(main_module, "GROQ_API_KEY", "test-key")
+    monkeypatch.setattr(main_module.health, "is_down", lambda name: name == "openai")
+    monkeypatch.setattr(main_module, "_call_openai", lambda *a, **k: calls.append("openai"))
+    monkeypatch.setattr(main_module, "_call_groq", lambda *a, **k: calls.append("groq") or "ok")
+
+    assert main_module._llm_chat([{"role": "user", "content": "hi"}], route="standard") == "ok"
+    assert calls == ["groq"]
@@ -0,0 +1,31 @@
+import io
+import json
+import queue
+import logging
+import logging.handlers
+
+from config import JsonFormatter, StructuredQueueHandler
+
+
+def test_json_logs_keep_the_traceback_in_exc():
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, handler)
+
+    logger = logging.getLogger("tests.json_exc")
+    logger.propagate = False
+    logger.addHandler(StructuredQueueHandler(log_queue))
+    listener.start()
+    try:
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.exception("request %s failed", "abc")
+    finally:
+        listener.stop()
+
+    entry = json.loads(stream.getvalue().strip())
+    assert entry['msg'] == "request abc failed"
+    assert "Traceback" in entry['exc'] and "ValueError: boom" in entry['exc']
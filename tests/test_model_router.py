@@ -0,0 +1,16 @@
+from services.model_router import ModelRouter
+
+
+def _models(router, route, provider=None):
+    return [m for p, m in router.route(route)['candidates'] if provider in (None, p)]
+
+
+def test_standard_and_complex_routes_pick_different_models():
+    router = ModelRouter()
+    standard = router.classify("Let's fill in my weekly template", stage='first')
+    complex_ = router.classify("Explain why my squat stalls, step by step")
+    assert (standard, complex_) == ('standard', 'complex')
+    assert _models(router, standard) != _models(router, complex_)
+    # The Groq-only chat path keeps the small model for templated stages
+    assert all('8b' in m for m in _models(router, standard, 'groq'))
+    assert all('70b' in m for m in _models(router, complex_, 'groq'))
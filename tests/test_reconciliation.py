@@ -0,0 +1,106 @@
+import time
+from types import SimpleNamespace
+
+import stripe
+
+from database import Database
+from services.fault_injection import FaultInjector
+from services.reconciliation_service import ReconciliationService
+
+
+class _Query:
+    """Supabase query builder stand-in: every select returns no rows"""
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        return SimpleNamespace(data=[])
+
+
+class _Supabase:
+    configured = True
+
+    def __init__(self):
+        self.client = SimpleNamespace(table=lambda name: _Query())
+        self.upserts = {}
+
+    def run(self, name, fn):
+        return fn()
+
+    def upsert(self, table, rows):
+        self.upserts.setdefault(table, []).extend(rows)
+
+
+def _page(items):
+    return SimpleNamespace(auto_paging_iter=lambda: iter(items))
+
+
+def _subscription(sub_id, customer, status="active"):
+    return stripe.Subscription.construct_from({
+        "id": sub_id, "object": "subscription", "customer": customer, "status": status, "created": 1,
+        "items": {"object": "list", "data": [
+            {"id": f"si_{sub_id}", "object": "subscription_item", "current_period_end": 1700000000},
+        ]},
+    }, "sk_test")
+
+
+def _stripe_api(subscriptions=(), events=(), customers=None):
+    customers = customers or {}
+    return SimpleNamespace(
+        api_key="sk_test",
+        Subscription=SimpleNamespace(list=lambda **kwargs: _page(subscriptions)),
+        Event=SimpleNamespace(list=lambda **kwargs: _page(events)),
+        Customer=SimpleNamespace(retrieve=lambda cid: stripe.Customer.construct_from(customers[cid], "sk_test")),
+    )
+
+
+def test_full_run_reads_real_stripe_objects(tmp_path):
+    sub = _subscription("sub_1", {"id": "cus_1", "object": "customer", "email": "Member@Example.com"})
+    sb = _Supabase()
+    service = ReconciliationService(Database(str(tmp_path / "app.db")), sb, _stripe_api([sub]))
+
+    result = service.run_once(full=True)
+
+    assert result["ok"], result
+    assert result["unresolved_emails"] == 0
+    assert sb.upserts["subscriptions"] == [{
+        "email": "member@example.com", "stripe_subscription_id": "sub_1",
+        "status": "active", "current_period_end": 1700000000,
+    }]
+    assert sb.upserts["user_profiles"][0]["is_member"] is True
+
+
+def test_incremental_run_reads_events_and_looks_up_customers(tmp_path):
+    db = Database(str(tmp_path / "app.db"))
+    db.set_sync_watermark("stripe:subscriptions", int(time.time()) - 60)
+    event = stripe.Event.construct_from({
+        "id": "evt_1", "object": "event", "type": "customer.subscription.deleted",
+        "data": {"object": _subscription("sub_2", "cus_2", status="canceled").to_dict()},
+    }, "sk_test")
+    sb = _Supabase()
+    api = _stripe_api(events=[event], customers={"cus_2": {"id": "cus_2", "object": "customer",
+                                                            "email": "gone@example.com"}})
+    service = ReconciliationService(db, sb, api)
+
+    result = service.run_once()
+
+    assert result["ok"], result
+    assert result["mode"] == "incremental" and result["unresolved_emails"] == 0
+    assert sb.upserts["user_profiles"][0] == {
+        "email": "gone@example.com", "is_member": False, "stripe_status": "canceled", "plan": "elite",
+    }
+
+
+def test_stripe_calls_go_through_fault_injection(tmp_path):
+    sub = _subscription("sub_3", "cus_3")
+    sb = _Supabase()
+    injector = FaultInjector(allowed=True, rules={"stripe": {"error_rate": 1.0}})
+    service = ReconciliationService(Database(str(tmp_path / "app.db")), sb, _stripe_api([sub]),
+                                    fault_injector=injector)
+
+    result = service.run_once(full=True)
+
+    assert result["ok"] is False
+    assert injector.snapshot()["injected"]["stripe"]["error"] == 1
+    assert sb.upserts == {}
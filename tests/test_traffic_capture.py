@@ -0,0 +1,44 @@
+import json
+import time
+
+from flask import Flask, request
+
+from services.traffic_capture import TrafficCapture
+
+app = Flask(__name__)
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_writer_survives_an_unwritable_entry(tmp_path):
+    path = tmp_path / "capture.ndjson"
+    capture = TrafficCapture(str(path))
+    capture._queue.put({(1, 2): "tuple keys are not valid JSON"})
+    with app.test_request_context("/api/lead", method="POST", json={"email": "a@b.c"}):
+        capture.record(request, 200, 1.0)
+
+    assert _wait_for(lambda: capture.stats()["captured"] == 1)
+    stats = capture.stats()
+    assert stats["write_errors"] == 1 and stats["writer_alive"]
+    entry = json.loads(path.read_text().strip())
+    assert entry["p"] == "/api/lead" and entry["b"]["email"].endswith("@example.com")
+
+
+def test_full_queue_drops_entries_while_the_writer_cannot_write(tmp_path):
+    # The directory does not exist, so the writer keeps failing to open the file
+    capture = TrafficCapture(str(tmp_path / "missing" / "capture.ndjson"), max_queue=2)
+    with app.test_request_context("/api/chat", method="POST", json={}):
+        for _ in range(5):
+            capture.record(request, 200, 1.0)
+
+    stats = capture.stats()
+    assert stats["queued"] == 2 and stats["dropped"] == 3
+    assert _wait_for(lambda: capture.stats()["write_errors"] >= 1)
+    assert capture.stats()["writer_alive"]